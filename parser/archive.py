@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+DEFAULT_PATH = os.path.join("data", "archive.sqlite3")
+DATE_FORMATS = ("%d/%m/%Y", "%Y-%m-%d")
+
+
+def parse_day(date_key: str) -> date:
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(date_key, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date: {date_key}")
+
+
+class Archive:
+    # Every published day, one row per pharmacy on duty. Rows are never
+    # deleted; republishing a day only fills in coordinates missing before.
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS duties (
+                day TEXT NOT NULL,
+                city TEXT NOT NULL,
+                district TEXT NOT NULL,
+                name TEXT NOT NULL,
+                address TEXT NOT NULL,
+                phone TEXT NOT NULL,
+                lat REAL,
+                long REAL,
+                archived_at REAL NOT NULL,
+                PRIMARY KEY (day, city, district, name)
+            );
+            CREATE INDEX IF NOT EXISTS idx_duties_pharmacy ON duties (city, district, name, day);
+            """
+        )
+
+    def record_day(self, date_key: str, pharmacies: list) -> int:
+        day = parse_day(date_key).isoformat()
+        now = time.time()
+        with self.lock, self.conn:
+            return self.conn.executemany(
+                """
+                INSERT INTO duties (day, city, district, name, address, phone, lat, long, archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (day, city, district, name) DO UPDATE SET
+                    lat = COALESCE(duties.lat, excluded.lat),
+                    long = COALESCE(duties.long, excluded.long)
+                """,
+                (
+                    (
+                        day,
+                        record["city"],
+                        record["district"],
+                        record["name"],
+                        record["address"],
+                        record["phone"],
+                        record.get("lat"),
+                        record.get("long"),
+                        now,
+                    )
+                    for record in pharmacies
+                ),
+            ).rowcount
+
+    def history(self, since: date) -> list:
+        with self.lock:
+            return self.conn.execute(
+                """
+                SELECT city, district, name, address, day, lat, long FROM duties
+                WHERE day >= ? ORDER BY city, district, name, day
+                """,
+                (since.isoformat(),),
+            ).fetchall()
+
+    def stats(self) -> dict:
+        with self.lock:
+            days, rows, first, last = self.conn.execute(
+                "SELECT COUNT(DISTINCT day), COUNT(*), MIN(day), MAX(day) FROM duties"
+            ).fetchone()
+        return {"days": days, "rows": rows, "first": first, "last": last}
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    global _archive
+
+    path = os.getenv("ARCHIVE_PATH", DEFAULT_PATH)
+    if not path:
+        return None
+
+    with _archive_lock:
+        if _archive is None:
+            try:
+                _archive = Archive(path)
+            except sqlite3.Error as e:
+                print(f"✗ Archive unavailable: {e}")
+                return None
+        return _archive
+
+
+def archive_day(date_key: str, pharmacies: list) -> int:
+    archive = get_archive()
+    if archive is None:
+        return 0
+    try:
+        return archive.record_day(date_key, pharmacies)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"✗ Archive error: {e}")
+        return 0
@@ -0,0 +1,286 @@
+import asyncio
+import time
+from functools import partial, wraps
+
+import httpx
+
+import metrics
+from coord_cache import BatchCache, get_cache
+from extract import extract_coordinates, extract_rows, extract_token, is_query_form
+from rate_limiter import get_limiter
+from resilience import DeadlineExceeded, attempt_scope, before_request_async, deadline_scope, record_outcome, retry_async
+from session_pool import SessionPool, TokenExpired, get_pool_size
+from parser import (
+    BASE_URL,
+    COORD_PUBLISH_EVERY,
+    COORD_RETRY_BUDGET,
+    COORD_RETRY_ROUNDS,
+    HEADERS,
+    cache_coordinates,
+    make_result,
+    missing_coordinates,
+    parse_pharmacies,
+)
+
+COORD_CONCURRENCY = 2
+
+
+def create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(headers=HEADERS, timeout=5, follow_redirects=True)
+
+
+def async_retry_on_failure(retries=5):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(1, retries + 1):
+                try:
+                    with attempt_scope(attempt):
+                        return await func(*args, **kwargs)
+                except httpx.HTTPError:
+                    if attempt == retries or not await retry_async("request", attempt):
+                        raise
+            return None
+
+        return wrapper
+
+    return decorator
+
+
+@async_retry_on_failure()
+async def make_request(client: httpx.AsyncClient, url: str, method: str = "GET", **kwargs) -> httpx.Response:
+    kwargs["timeout"] = await before_request_async(kwargs.get("timeout", 5))
+    limiter = get_limiter()
+    started = time.monotonic()
+    await limiter.acquire_async()
+    metrics.observe_phase("rate_wait", time.monotonic() - started)
+    started = time.monotonic()
+    try:
+        if method.upper() == "GET":
+            response = await client.get(url, **kwargs)
+        else:
+            response = await client.post(url, **kwargs)
+    except httpx.HTTPError:
+        limiter.record(time.monotonic() - started, error=True)
+        record_outcome(error=True)
+        metrics.count_request(url, "error")
+        raise
+    limiter.record(time.monotonic() - started, response.status_code)
+    record_outcome(response.status_code)
+    metrics.count_request(url, response.status_code, len(response.content))
+    response.raise_for_status()
+    return response
+
+
+@metrics.timed("token")
+async def fetch_token(client: httpx.AsyncClient) -> str:
+    response = await make_request(client, BASE_URL)
+    return extract_token(response.content)
+
+
+@metrics.timed("submit")
+async def submit_query(client: httpx.AsyncClient, plaka_kodu: str, tarih: str, token: str) -> str:
+    payload = {
+        "plakaKodu": plaka_kodu,
+        "nobetTarihi": tarih,
+        "token": token,
+        "btn": "Sorgula",
+    }
+    response = await make_request(client, f"{BASE_URL}?submit", method="POST", data=payload)
+    if is_query_form(response.content):
+        raise TokenExpired(extract_token(response.content))
+    return extract_token(response.content)
+
+
+async def query_city(pooled, plaka_kodu: str, tarih: str) -> None:
+    if pooled.token is None:
+        pooled.remember(await fetch_token(pooled.session))
+    try:
+        pooled.remember(await submit_query(pooled.session, plaka_kodu, tarih, pooled.token))
+    except TokenExpired as expired:
+        metrics.count_retry("token")
+        pooled.token = expired.token or await fetch_token(pooled.session)
+        try:
+            pooled.remember(await submit_query(pooled.session, plaka_kodu, tarih, pooled.token))
+        except TokenExpired:
+            await requery_fresh(pooled, plaka_kodu, tarih)
+    pooled.queries += 1
+
+
+async def requery_fresh(pooled, plaka_kodu: str, tarih: str) -> None:
+    # Same fallback as the thread engine's requery_fresh().
+    metrics.count_session("replaced")
+    await pooled.session.aclose()
+    pooled.session = create_client()
+    pooled.token = await fetch_token(pooled.session)
+    try:
+        pooled.remember(await submit_query(pooled.session, plaka_kodu, tarih, pooled.token))
+    except TokenExpired as rejected:
+        metrics.count_session("form_after_submit")
+        pooled.remember(rejected.token)
+
+
+def create_pool(size: int = None) -> SessionPool:
+    # Clients belong to the event loop that made them, so each sweep gets
+    # its own pool and closes it with close_pool() before the loop ends.
+    return SessionPool(size if size is not None and get_pool_size() else get_pool_size())
+
+
+async def close_pool(pool: SessionPool) -> None:
+    for client in pool.drain():
+        await client.aclose()
+
+
+@metrics.timed("rows")
+async def fetch_pharmacy_rows(client: httpx.AsyncClient) -> list:
+    response = await make_request(client, f"{BASE_URL}?nobetci=Eczaneler")
+    return extract_rows(response.content)
+
+
+@metrics.timed("coordinates")
+async def get_coordinates(client: httpx.AsyncClient, index: int, max_retries=3):
+    url_coord = f"{BASE_URL}?harita=Goster&index={index}"
+    payload = {"harita": "Goster", "index": str(index)}
+
+    for attempt in range(max_retries):
+        try:
+            with attempt_scope(attempt + 1):
+                response = await make_request(client, url_coord, method="POST", data=payload)
+
+            lat, lon = extract_coordinates(response.content)
+            if lat is not None:
+                metrics.count_coordinate("lookup")
+                return lat, lon
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            pass
+
+        if attempt == max_retries - 1 or not await retry_async("coordinate", attempt + 1):
+            break
+
+    metrics.count_coordinate("miss")
+    return None, None
+
+
+async def lookup_coordinates(client: httpx.AsyncClient, pending: list, cache=None, max_retries=3) -> None:
+    semaphore = asyncio.Semaphore(COORD_CONCURRENCY)
+
+    async def resolve(idx, pharmacy):
+        async with semaphore:
+            pharmacy.lat, pharmacy.long = await get_coordinates(client, idx, max_retries)
+        cache_coordinates(cache, pharmacy)
+
+    await asyncio.gather(*(resolve(idx, p) for idx, p in pending))
+
+
+async def publish_list(on_list, indexed_pharmacies: list) -> None:
+    if on_list is None:
+        return
+    # This city's coroutine waits for the callback, so the records cannot
+    # change under it and are handed over without copying.
+    try:
+        await asyncio.to_thread(on_list, [p for _, p in indexed_pharmacies])
+    except Exception as e:
+        print(f"✗ List publish error: {e}")
+
+
+async def resolve_coordinates(client: httpx.AsyncClient, indexed_pharmacies: list, cache=None, on_list=None) -> None:
+    pending = missing_coordinates(indexed_pharmacies)
+
+    await publish_list(on_list, indexed_pharmacies)
+
+    for start in range(0, len(pending), COORD_PUBLISH_EVERY):
+        await lookup_coordinates(client, pending[start:start + COORD_PUBLISH_EVERY], cache)
+        if start + COORD_PUBLISH_EVERY < len(pending):
+            await publish_list(on_list, indexed_pharmacies)
+
+
+async def retry_missing_coordinates(client: httpx.AsyncClient, indexed_pharmacies: list, cache=None) -> int:
+    budget = COORD_RETRY_BUDGET
+    retried = 0
+
+    for retry_round in range(COORD_RETRY_ROUNDS):
+        missing = missing_coordinates(indexed_pharmacies)[:budget]
+        if not missing or not await retry_async("coordinate_round", retry_round + 1):
+            break
+        with attempt_scope(retry_round + 2):
+            await lookup_coordinates(client, missing, cache, max_retries=1)
+        budget -= len(missing)
+        retried += len(missing)
+
+    return retried
+
+
+async def scrape_pharmacies(plaka_kodu: str, tarih: str, max_retries=3, on_list=None, pool=None, cache=None) -> dict:
+    start_time = time.time()
+    cache = cache or get_cache()
+
+    for attempt in range(max_retries):
+        with attempt_scope(attempt + 1):
+            indexed_pharmacies = []
+            pooled = pool.acquire(create_client)
+            healthy = False
+            try:
+                await query_city(pooled, plaka_kodu, tarih)
+                client = pooled.session
+                indexed_pharmacies = list(parse_pharmacies(await fetch_pharmacy_rows(client), cache))
+
+                if len(indexed_pharmacies) == 0:
+                    if attempt < max_retries - 1 and await retry_async("city", attempt + 2):
+                        continue
+                    healthy = True
+                    return make_result(True, start_time)
+
+                await resolve_coordinates(client, indexed_pharmacies, cache, on_list)
+                await retry_missing_coordinates(client, indexed_pharmacies, cache)
+                healthy = True
+                return make_result(True, start_time, [p for _, p in indexed_pharmacies])
+
+            except DeadlineExceeded:
+                metrics.count_retry_denied("city", "deadline")
+                return make_result(bool(indexed_pharmacies), start_time, [p for _, p in indexed_pharmacies])
+            except Exception:
+                if attempt < max_retries - 1 and await retry_async("city", attempt + 2):
+                    continue
+                return make_result(False, start_time)
+            finally:
+                pool.release(pooled, healthy)
+
+    return make_result(False, start_time)
+
+
+async def parser(plaka_kodu: str, tarih: str, on_list=None, pool=None, cache=None) -> dict:
+    own_pool = pool is None
+    pool = pool or create_pool()
+    try:
+        if not plaka_kodu.isdigit() or not (1 <= int(plaka_kodu) <= 81):
+            return {"success": False, "tooktime": 0, "count": 0, "list": []}
+        with metrics.city_scope(plaka_kodu, tarih) as stats, deadline_scope():
+            result = await scrape_pharmacies(plaka_kodu, tarih, on_list=on_list, pool=pool, cache=cache)
+        result["metrics"] = stats.as_dict()
+        return result
+    except Exception:
+        return {"success": False, "tooktime": 0, "count": 0, "list": []}
+    finally:
+        if own_pool:
+            await close_pool(pool)
+
+
+async def parser_dates(plaka_kodu: str, dates: list, on_list=None, pool=None) -> dict:
+    own_pool = pool is None
+    pool = pool or create_pool(1)
+    cache = BatchCache(get_cache())
+    results = {}
+    try:
+        for tarih in dates:
+            callback = partial(on_list, tarih) if on_list else None
+            results[tarih] = await parser(plaka_kodu, tarih, callback, pool, cache)
+    finally:
+        if own_pool:
+            await close_pool(pool)
+    return results
+
+
+if __name__ == "__main__":
+    print(asyncio.run(parser("2", "13/06/2025")))
@@ -0,0 +1,119 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replay_server import add_config_arguments, config_from_args, server_url, start_server
+
+
+def parse_plaka_codes(value: str) -> list:
+    codes = []
+    for part in value.split(","):
+        start, _, end = part.partition("-")
+        codes.extend(str(code) for code in range(int(start), int(end or start) + 1))
+    return codes
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def report(name: str, elapsed: float, cities: int, server_stats: dict) -> dict:
+    return {
+        "benchmark": name,
+        "cities": cities,
+        "seconds": round(elapsed, 2),
+        "cities_per_minute": round(cities / elapsed * 60, 1) if elapsed else 0,
+        "requests_per_city": round(server_stats["requests"] / cities, 1) if cities else 0,
+        "requests": server_stats["requests"],
+        "by_endpoint": server_stats["by_endpoint"],
+        "bytes_per_city": round(server_stats["bytes_sent"] / cities) if cities else 0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_parser(server, plaka_codes: list, tarih: str) -> dict:
+    from parser import parser
+
+    server.state.reset()
+    started = time.perf_counter()
+    for plaka_kodu in plaka_codes:
+        parser(plaka_kodu, tarih)
+    return report("parser", time.perf_counter() - started, len(plaka_codes), server.state.stats())
+
+
+def bench_sweep(server, plaka_codes: list, tarih: str, engine: str, verbose: bool, storage=None) -> dict:
+    from main import process_single_date
+
+    server.state.reset()
+    started = time.perf_counter()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        process_single_date(storage, tarih, engine, plaka_codes)
+    return report(f"sweep:{engine}", time.perf_counter() - started, len(plaka_codes), server.state.stats())
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the scraper against the offline replay server")
+    arg_parser.add_argument("--cities", default="1-81", help="plate codes, e.g. 1-81 or 6,34,35")
+    arg_parser.add_argument("--date", default="13/06/2025")
+    arg_parser.add_argument("--mode", choices=("parser", "sweep", "both"), default="both")
+    arg_parser.add_argument("--engine", choices=("thread", "async"), default="thread")
+    arg_parser.add_argument("--concurrency", type=int, default=None)
+    arg_parser.add_argument("--rate", type=float, default=None, help="initial request rate (PARSER_RATE)")
+    arg_parser.add_argument("--max-rate", type=float, default=50, help="rate limiter ceiling (PARSER_MAX_RATE)")
+    arg_parser.add_argument("--cache", action="store_true", help="keep the coordinate cache enabled")
+    arg_parser.add_argument(
+        "--storage", choices=("none", "file", "sqlite"), default="none", help="store sweep results in a temp backend"
+    )
+    arg_parser.add_argument("--verbose", action="store_true")
+    arg_parser.add_argument("--output", help="write the JSON report to this file")
+    add_config_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    server = start_server(config_from_args(args))
+    os.environ["PARSER_BASE_URL"] = server_url(server)
+    os.environ["PARSER_MAX_RATE"] = str(args.max_rate)
+    if args.rate:
+        os.environ["PARSER_RATE"] = str(args.rate)
+    if args.concurrency:
+        os.environ["PARSER_CONCURRENCY"] = str(args.concurrency)
+
+    cache_dir = tempfile.TemporaryDirectory()
+    os.environ["COORD_CACHE_PATH"] = os.path.join(cache_dir.name, "coordinates.sqlite3") if args.cache else ""
+
+    storage = None
+    if args.storage != "none":
+        from storage import get_storage
+
+        os.environ["STORAGE_PATH"] = os.path.join(cache_dir.name, f"pharmacies.{args.storage}")
+        storage = get_storage(args.storage)
+
+    plaka_codes = parse_plaka_codes(args.cities)
+    results = []
+    if args.mode in ("parser", "both"):
+        results.append(bench_parser(server, plaka_codes, args.date))
+    if args.mode in ("sweep", "both"):
+        results.append(bench_sweep(server, plaka_codes, args.date, args.engine, args.verbose, storage))
+
+    server.shutdown()
+    cache_dir.cleanup()
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
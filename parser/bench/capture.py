@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extract import extract_coordinates, extract_rows, extract_token, is_query_form
+from parser import BASE_URL, create_session
+from replay_server import CAPTURED_DIR
+
+TBODY_PATTERN = re.compile(r"(<table\b[^>]*?\bid=[\"']searchTable[\"'].*?<tbody[^>]*>)(.*?)(</tbody>)", re.S | re.I)
+ROW_PATTERN = re.compile(r"<tr\b.*?</tr>", re.S | re.I)
+CELL_PATTERN = re.compile(r"(<td\b[^>]*>)(.*?)(</td>)", re.S | re.I)
+INDEX_PATTERN = re.compile(r"index=\d+")
+HIDDEN_VALUE_PATTERN = re.compile(r"(<input\b[^>]*?type=[\"']hidden[\"'][^>]*?value=[\"'])([^\"']*)", re.I)
+LAT_TEMPLATE_PATTERN = re.compile(r"(var latti = parseFloat\()[\d.]+(\))")
+LON_TEMPLATE_PATTERN = re.compile(r"(var longi = parseFloat\()[\d.]+(\))")
+ROW_FIELDS = ("name", "district", "phone", "address")
+
+
+def sanitize(page: bytes) -> str:
+    # Templates use string.Template, so literal dollars are escaped, and
+    # the page's token and any other hidden form values are blanked out.
+    text = page.decode("utf-8").replace("$", "$$")
+    token = extract_token(page)
+    if token:
+        text = text.replace(token, "$token")
+    return HIDDEN_VALUE_PATTERN.sub(lambda m: m.group(1) + ("$token" if m.group(2) == "$token" else ""), text)
+
+
+def row_template(row: str) -> str:
+    cells = iter(ROW_FIELDS)
+
+    def placeholder(match):
+        field = next(cells, None)
+        return f"{match.group(1)}${field}{match.group(3)}" if field else match.group(0)
+
+    return INDEX_PATTERN.sub("index=$index", CELL_PATTERN.sub(placeholder, row))
+
+
+def results_templates(page: str):
+    match = TBODY_PATTERN.search(page)
+    if not match:
+        raise ValueError("results page has no #searchTable body")
+    rows = ROW_PATTERN.findall(match.group(2))
+    if not rows:
+        raise ValueError("results page has no rows, pick a city and date with pharmacies on duty")
+    results = page[:match.start(2)] + "\n$rows\n" + page[match.end(2):]
+    return results, row_template(rows[0])
+
+
+def map_template(page: str) -> str:
+    page = LAT_TEMPLATE_PATTERN.sub(r"\g<1>$lat\g<2>", page, count=1)
+    return LON_TEMPLATE_PATTERN.sub(r"\g<1>$long\g<2>", page, count=1)
+
+
+def capture(plaka_kodu: str, tarih: str) -> tuple:
+    session = create_session()
+    pages = {}
+    report = {"city": plaka_kodu, "date": tarih}
+
+    response = session.get(BASE_URL, timeout=10)
+    pages["token"] = response.content
+    token = extract_token(response.content)
+    report["token_found"] = token is not None
+
+    payload = {"plakaKodu": plaka_kodu, "nobetTarihi": tarih, "token": token, "btn": "Sorgula"}
+    response = session.post(f"{BASE_URL}?submit", data=payload, timeout=10)
+    pages["submit"] = response.content
+    report["submit"] = {
+        "redirects": [r.status_code for r in response.history],
+        "final_url": response.url,
+        "is_query_form": is_query_form(response.content),
+    }
+
+    response = session.get(f"{BASE_URL}?nobetci=Eczaneler", timeout=10)
+    pages["results"] = response.content
+    rows = extract_rows(response.content)
+    report["rows"] = len(rows)
+
+    response = session.post(f"{BASE_URL}?harita=Goster&index=0", data={"harita": "Goster", "index": "0"}, timeout=10)
+    pages["map"] = response.content
+    report["map_coordinates"] = extract_coordinates(response.content)
+
+    response = session.post(
+        f"{BASE_URL}?harita=Goster&index={len(rows) + 50}",
+        data={"harita": "Goster", "index": str(len(rows) + 50)},
+        timeout=10,
+    )
+    pages["map_missing"] = response.content
+    report["map_missing_coordinates"] = extract_coordinates(response.content)
+
+    # A stale token on a session that already queried: this is the response
+    # is_query_form() has to recognise as a rejection.
+    stale = {**payload, "token": "0" * len(token or "0")}
+    response = session.post(f"{BASE_URL}?submit", data=stale, timeout=10)
+    pages["submit_expired"] = response.content
+    report["stale_submit"] = {
+        "redirects": [r.status_code for r in response.history],
+        "is_query_form": is_query_form(response.content),
+        "token_found": extract_token(response.content) is not None,
+    }
+
+    return pages, report
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Record the real query pages as sanitized replay templates and check the extractors against them"
+    )
+    arg_parser.add_argument("--city", default="6")
+    arg_parser.add_argument("--date", required=True, help="dd/mm/yyyy")
+    arg_parser.add_argument("--out", default=CAPTURED_DIR)
+    args = arg_parser.parse_args()
+
+    pages, report = capture(args.city, args.date)
+    templates = {name: sanitize(page) for name, page in pages.items()}
+    templates["results"], templates["row"] = results_templates(templates["results"])
+    templates["map"] = map_template(templates["map"])
+
+    os.makedirs(args.out, exist_ok=True)
+    for name, text in templates.items():
+        with open(os.path.join(args.out, f"{name}.html"), "w", encoding="utf-8") as f:
+            f.write(text)
+    with open(os.path.join(args.out, "capture.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report["submit"]["is_query_form"]:
+        print("✗ A valid submit is detected as a rejected token, is_query_form() needs fixing")
+    if not report["stale_submit"]["is_query_form"]:
+        print("✗ A stale token is not detected, is_query_form() needs fixing")
+    print(f"📝 Templates written to {args.out}, check them for personal data before committing")
+
+
+if __name__ == "__main__":
+    main()
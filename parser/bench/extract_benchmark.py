@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+
+import extract
+from replay_server import FIXTURES_DIR, city_pharmacies, load_fixtures
+
+
+# The pre-extract.py path, kept here as the baseline.
+def legacy_rows(content: bytes) -> list:
+    try:
+        soup = BeautifulSoup(content, "lxml")
+    except:
+        soup = BeautifulSoup(content, "html.parser")
+    table = soup.find("table", {"id": "searchTable"})
+    rows = table.find("tbody").find_all("tr") if table else []
+    return [[td.get_text(strip=True) for td in row.find_all("td")] for row in rows]
+
+
+def legacy_token(content: bytes) -> str:
+    soup = BeautifulSoup(content, "lxml")
+    return soup.body.get("data-token") if soup.body else None
+
+
+def legacy_coordinates(content: bytes):
+    text = content.decode("utf-8")
+    lat_match = re.search(r"var latti = parseFloat\(([\d\.]+)\);", text)
+    lon_match = re.search(r"var longi = parseFloat\(([\d\.]+)\);", text)
+    if lat_match and lon_match:
+        return float(lat_match.group(1)), float(lon_match.group(1))
+    return None, None
+
+
+def build_pages(plaka_kodu: str) -> dict:
+    fixtures = load_fixtures(FIXTURES_DIR)
+    pharmacies = city_pharmacies(plaka_kodu, "13/06/2025")
+    rows = "\n".join(fixtures["row"].safe_substitute(index=i, **p) for i, p in enumerate(pharmacies))
+    return {
+        "token": fixtures["token"].safe_substitute(token="0123456789abcdef").encode("utf-8"),
+        "results": fixtures["results"].safe_substitute(token="0123456789abcdef", rows=rows).encode("utf-8"),
+        "map": fixtures["map"].safe_substitute(token="0123456789abcdef", lat=41.0082, long=28.9784).encode("utf-8"),
+    }
+
+
+def measure(func, content: bytes, number: int) -> dict:
+    seconds = min(timeit.repeat(lambda: func(content), number=number, repeat=3))
+    tracemalloc.start()
+    func(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"us_per_call": round(seconds / number * 1e6, 1), "peak_alloc_kb": round(peak / 1024, 1)}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Compare extract.py with the BeautifulSoup extraction path")
+    arg_parser.add_argument("--city", default="34", help="plate code whose result page is used")
+    arg_parser.add_argument("--number", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    pages = build_pages(args.city)
+    assert [list(row) for row in extract.extract_rows(pages["results"])] == legacy_rows(pages["results"])
+    assert extract.extract_token(pages["token"]) == legacy_token(pages["token"])
+    assert extract.extract_coordinates(pages["map"]) == legacy_coordinates(pages["map"])
+
+    cases = {
+        "rows": (legacy_rows, extract.extract_rows, pages["results"]),
+        "token": (legacy_token, extract.extract_token, pages["token"]),
+        "coordinates": (legacy_coordinates, extract.extract_coordinates, pages["map"]),
+    }
+    results = {}
+    for name, (legacy, current, content) in cases.items():
+        before = measure(legacy, content, args.number)
+        after = measure(current, content, args.number)
+        results[name] = {
+            "page_bytes": len(content),
+            "beautifulsoup": before,
+            "extract": after,
+            "speedup": round(before["us_per_call"] / after["us_per_call"], 1),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import replay_server
+from pharmacy import Pharmacy, clean_phone_number
+from replay_server import add_config_arguments, config_from_args, server_url, start_server
+from storage import to_records
+
+
+def table_rows(plaka_kodu: str, tarih: str) -> list:
+    # The cell tuples extract_rows() hands to the parser.
+    return [
+        (p["name"], f"{p['district']} (İLÇE)", p["phone"], p["address"])
+        for p in replay_server.city_pharmacies(plaka_kodu, tarih)
+    ]
+
+
+def legacy_records(plaka_kodu: str, rows: list) -> list:
+    # The previous pipeline: a Turkish-keyed dict per row, a dict copy per
+    # list publish, then the English-keyed copy written to storage.
+    pharmacies = [
+        {
+            "Ad": cols[0],
+            "İlçe": cols[1].split(" ")[0],
+            "Adres": cols[3],
+            "Telefon": clean_phone_number(cols[2]),
+            "Lat": 41.0,
+            "Long": 29.0,
+        }
+        for cols in rows
+    ]
+    published = [dict(p) for p in pharmacies]
+    return [
+        {
+            "city": plaka_kodu,
+            "district": p["İlçe"],
+            "name": p["Ad"],
+            "phone": p["Telefon"],
+            "address": p["Adres"],
+            "lat": p["Lat"],
+            "long": p["Long"],
+        }
+        for p in published
+    ]
+
+
+def compact_records(plaka_kodu: str, rows: list) -> list:
+    pharmacies = [Pharmacy.from_row(cols) for cols in rows]
+    for pharmacy in pharmacies:
+        pharmacy.lat, pharmacy.long = 41.0, 29.0
+    return to_records(plaka_kodu, pharmacies)
+
+
+def traced(func) -> dict:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"peak_kb": round(peak / 1024, 1), "retained_kb": round(current / 1024, 1), "result": result}
+
+
+def bench_records(plaka_kodu: str, tarih: str) -> dict:
+    rows = table_rows(plaka_kodu, tarih)
+    results = {}
+    for name, build in (("legacy_dicts", legacy_records), ("pharmacy_slots", compact_records)):
+        measured = traced(lambda build=build: len(build(plaka_kodu, rows)))
+        measured.pop("result")
+        results[name] = measured
+    results["kept_per_record_bytes"] = {
+        "dict": sys.getsizeof({"Ad": "", "İlçe": "", "Adres": "", "Telefon": "", "Lat": 0.0, "Long": 0.0}),
+        "Pharmacy": sys.getsizeof(Pharmacy("", "", "", "")),
+    }
+    return results
+
+
+def bench_scrape(plaka_kodu: str, tarih: str) -> dict:
+    from parser import iter_pharmacies, parser
+
+    results = {}
+    measured = traced(lambda: parser(plaka_kodu, tarih)["count"])
+    measured["count"] = measured.pop("result")
+    results["parser"] = measured
+
+    def stream() -> int:
+        count = 0
+        for pharmacy in iter_pharmacies(plaka_kodu, tarih):
+            pharmacy.as_record(plaka_kodu)
+            count += 1
+        return count
+
+    measured = traced(stream)
+    measured["count"] = measured.pop("result")
+    results["iter_pharmacies"] = measured
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Measure peak memory of the pharmacy record pipeline")
+    arg_parser.add_argument("--city", default="34")
+    arg_parser.add_argument("--date", default="13/06/2025")
+    arg_parser.add_argument("--size", type=int, default=500, help="pharmacies on duty in the benchmarked city")
+    add_config_arguments(arg_parser)
+    arg_parser.set_defaults(latency=0.0, jitter=0.0)
+    args = arg_parser.parse_args()
+
+    replay_server.CITY_SIZES[args.city] = args.size
+    server = start_server(config_from_args(args))
+    os.environ["PARSER_BASE_URL"] = server_url(server)
+    os.environ["PARSER_RATE"] = os.environ["PARSER_MAX_RATE"] = "1000"
+    os.environ["COORD_CACHE_PATH"] = ""
+
+    results = {
+        "city": args.city,
+        "size": args.size,
+        "records": bench_records(args.city, args.date),
+        "scrape": bench_scrape(args.city, args.date),
+    }
+
+    server.shutdown()
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
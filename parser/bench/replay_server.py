@@ -0,0 +1,295 @@
+import argparse
+import hashlib
+import os
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, urlparse
+
+# fixtures/ holds hand-written stand-ins for the real pages; capture.py
+# records sanitized real ones into fixtures/captured/, which is preferred
+# whenever it exists.
+SYNTHETIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CAPTURED_DIR = os.path.join(SYNTHETIC_DIR, "captured")
+FIXTURES_DIR = CAPTURED_DIR if os.path.exists(os.path.join(CAPTURED_DIR, "token.html")) else SYNTHETIC_DIR
+SESSION_COOKIE = "TURKIYESESSIONID"
+
+# Rough duty list sizes for the biggest provinces; every other plate code
+# gets a stable pseudo-random size so runs stay comparable.
+CITY_SIZES = {"34": 60, "6": 35, "35": 35, "16": 20, "7": 20, "1": 18, "42": 18, "27": 16}
+
+
+class ReplayConfig:
+    def __init__(
+        self,
+        fixtures_dir=FIXTURES_DIR,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        map_miss_rate=0.0,
+        token_ttl=0.0,
+        seed=0,
+    ):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.map_miss_rate = map_miss_rate
+        self.token_ttl = token_ttl
+        self.seed = seed
+
+
+def load_fixtures(fixtures_dir: str) -> dict:
+    fixtures = {}
+    for name in ("token", "submit", "results", "row", "map", "map_missing", "submit_expired"):
+        path = os.path.join(fixtures_dir, f"{name}.html")
+        if name == "submit_expired" and not os.path.exists(path):
+            # The hand-written set assumes a rejected token shows the form again.
+            path = os.path.join(fixtures_dir, "token.html")
+        with open(path, encoding="utf-8") as f:
+            fixtures[name] = Template(f.read())
+    return fixtures
+
+
+def stable_random(*parts) -> random.Random:
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def city_pharmacies(plaka_kodu: str, tarih: str, seed: int = 0) -> list:
+    # Each city has a fixed pool of pharmacies and a date-dependent subset of
+    # it is on duty, like the real rotation.
+    size = CITY_SIZES.get(plaka_kodu) or stable_random(seed, plaka_kodu).randint(4, 14)
+    pool_rng = stable_random(seed, plaka_kodu, "pool")
+    base_lat = 36.5 + pool_rng.random() * 5
+    base_long = 27.0 + pool_rng.random() * 16
+
+    pool = []
+    for number in range(size * 3):
+        district = f"İLÇE{number % 6 + 1}"
+        pool.append(
+            {
+                "name": f"ECZANE {plaka_kodu}-{number}",
+                "district": district,
+                "phone": f"0 (3{pool_rng.randint(10, 99)}) {pool_rng.randint(100, 999)} {pool_rng.randint(10, 99)} {pool_rng.randint(10, 99)}",
+                "address": f"{district} Mah. {number}. Sok. No:{pool_rng.randint(1, 120)}",
+                "lat": round(base_lat + pool_rng.random() * 0.4, 6),
+                "long": round(base_long + pool_rng.random() * 0.4, 6),
+            }
+        )
+
+    return stable_random(seed, plaka_kodu, tarih).sample(pool, size)
+
+
+class ReplayState:
+    def __init__(self, config: ReplayConfig):
+        self.config = config
+        self.fixtures = load_fixtures(config.fixtures_dir)
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(config.seed)
+        self.counts = {}
+        self.bytes_sent = 0
+
+    def count(self, endpoint: str, size: int = 0) -> None:
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            self.bytes_sent += size
+
+    def roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.rng.random() < rate
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": sum(self.counts.values()),
+                "by_endpoint": dict(self.counts),
+                "bytes_sent": self.bytes_sent,
+                "sessions": len(self.sessions),
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counts = {}
+            self.bytes_sent = 0
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    server_version = "ReplayServer/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> ReplayState:
+        return self.server.state
+
+    def session(self):
+        cookies = self.headers.get("Cookie", "")
+        for part in cookies.split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == SESSION_COOKIE and value in self.state.sessions:
+                return value, self.state.sessions[value]
+
+        session_id = secrets.token_hex(16)
+        session = {"token": secrets.token_hex(8), "issued_at": time.monotonic(), "query": None}
+        with self.state.lock:
+            self.state.sessions[session_id] = session
+        return session_id, session
+
+    def reply(self, endpoint: str, session_id: str, body: str = "", status: int = 200) -> None:
+        config = self.state.config
+        if config.latency or config.jitter:
+            time.sleep(max(0.0, config.latency + self.state.rng.uniform(-config.jitter, config.jitter)))
+
+        payload = body.encode("utf-8")
+        self.state.count(endpoint, len(payload))
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Set-Cookie", f"{SESSION_COOKIE}={session_id}; Path=/")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def token_valid(self, session: dict, token: str) -> bool:
+        if token != session["token"]:
+            return False
+        ttl = self.state.config.token_ttl
+        return not ttl or time.monotonic() - session["issued_at"] < ttl
+
+    def injected_failure(self, endpoint: str, session_id: str) -> bool:
+        if self.state.roll(self.state.config.throttle_rate):
+            self.reply(f"{endpoint}:429", session_id, status=429)
+            return True
+        if self.state.roll(self.state.config.error_rate):
+            self.reply(f"{endpoint}:503", session_id, status=503)
+            return True
+        return False
+
+    def read_form(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8")) if length else {}
+        return {key: values[0] for key, values in form.items()}
+
+    def do_GET(self):
+        session_id, session = self.session()
+        query = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+
+        if "nobetci" in query:
+            if self.injected_failure("results", session_id):
+                return
+            fixtures = self.state.fixtures
+            rows = []
+            if session["query"]:
+                plaka_kodu, tarih = session["query"]
+                for index, pharmacy in enumerate(city_pharmacies(plaka_kodu, tarih, self.state.config.seed)):
+                    rows.append(fixtures["row"].safe_substitute(index=index, **pharmacy))
+            body = fixtures["results"].safe_substitute(token=session["token"], rows="\n".join(rows))
+            self.reply("results", session_id, body)
+            return
+
+        if self.injected_failure("token", session_id):
+            return
+        self.reply("token", session_id, self.state.fixtures["token"].safe_substitute(token=session["token"]))
+
+    def do_POST(self):
+        session_id, session = self.session()
+        query = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+        form = self.read_form()
+        fixtures = self.state.fixtures
+
+        if "harita" in query or "harita" in form:
+            if self.injected_failure("map", session_id):
+                return
+            pharmacies = city_pharmacies(*session["query"], self.state.config.seed) if session["query"] else []
+            try:
+                pharmacy = pharmacies[int(form.get("index", query.get("index", ["-1"])[0]))]
+            except (IndexError, ValueError):
+                pharmacy = None
+
+            if pharmacy is None or self.state.roll(self.state.config.map_miss_rate):
+                self.reply("map", session_id, fixtures["map_missing"].safe_substitute(token=session["token"]))
+            else:
+                body = fixtures["map"].safe_substitute(token=session["token"], lat=pharmacy["lat"], long=pharmacy["long"])
+                self.reply("map", session_id, body)
+            return
+
+        if self.injected_failure("submit", session_id):
+            return
+        if not self.token_valid(session, form.get("token")):
+            # A stale token drops the query and answers with the recorded
+            # rejection page, carrying a fresh token.
+            session.update(token=secrets.token_hex(8), issued_at=time.monotonic(), query=None)
+            self.reply("submit:expired", session_id, fixtures["submit_expired"].safe_substitute(token=session["token"]))
+            return
+        if form.get("plakaKodu"):
+            session["query"] = (form["plakaKodu"], form.get("nobetTarihi", ""))
+        self.reply("submit", session_id, fixtures["submit"].safe_substitute(token=session["token"]))
+
+
+def start_server(config: ReplayConfig = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ReplayHandler)
+    server.daemon_threads = True
+    server.state = ReplayState(config or ReplayConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/saglik-titck-nobetci-eczane-sorgulama"
+
+
+def add_config_arguments(arg_parser: argparse.ArgumentParser) -> None:
+    arg_parser.add_argument("--fixtures", default=FIXTURES_DIR, help="directory with recorded pages")
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="mean response latency in seconds")
+    arg_parser.add_argument("--jitter", type=float, default=0.02, help="latency jitter in seconds")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    arg_parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    arg_parser.add_argument("--map-miss-rate", type=float, default=0.0, help="share of map pages without coordinates")
+    arg_parser.add_argument("--token-ttl", type=float, default=0.0, help="seconds a session token stays valid (0: forever)")
+    arg_parser.add_argument("--seed", type=int, default=0)
+
+
+def config_from_args(args) -> ReplayConfig:
+    return ReplayConfig(
+        fixtures_dir=args.fixtures,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        map_miss_rate=args.map_miss_rate,
+        token_ttl=args.token_ttl,
+        seed=args.seed,
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Offline stand-in for the turkiye.gov.tr duty pharmacy pages")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    server = start_server(config_from_args(args), args.host, args.port)
+    print(f"Replaying on {server_url(server)} (set PARSER_BASE_URL to this)")
+    if args.fixtures == SYNTHETIC_DIR:
+        print("⚠️ Using hand-written fixtures, run capture.py to record the real pages")
+    try:
+        while True:
+            time.sleep(60)
+            print(server.state.stats())
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot
+from pharmacy import Pharmacy
+from replay_server import city_pharmacies
+from storage import to_records
+
+
+def build_day(tarih: str) -> list:
+    pharmacies = []
+    for plaka_kodu in map(str, range(1, 82)):
+        rows = [
+            Pharmacy(p["name"], p["district"], p["phone"], p["address"], p["lat"], p["long"])
+            for p in city_pharmacies(plaka_kodu, tarih)
+        ]
+        pharmacies.extend(to_records(plaka_kodu, rows))
+    return pharmacies
+
+
+def decode_seconds(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Compare the compact snapshot with the published day JSON")
+    arg_parser.add_argument("--date", default="13/06/2025")
+    arg_parser.add_argument("--number", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    pharmacies = build_day(args.date)
+    built = snapshot.build_snapshot(pharmacies, list(snapshot.compressors()))
+    assert snapshot.decode_snapshot(built["payloads"]["identity"]) == pharmacies
+
+    # The current format: what publish_day writes under the date key.
+    day_json = json.dumps(pharmacies, ensure_ascii=False).encode("utf-8")
+    day_gzip = gzip.compress(day_json, mtime=0)
+    variants = {
+        "json": (day_json, lambda: json.loads(day_json)),
+        "json+gzip": (day_gzip, lambda: json.loads(gzip.decompress(day_gzip))),
+    }
+    for encoding, payload in built["payloads"].items():
+        name = "snapshot" if encoding == "identity" else f"snapshot+{encoding}"
+        variants[name] = (payload, lambda payload=payload, encoding=encoding: snapshot.decode_snapshot(payload, encoding))
+
+    results = {"records": len(pharmacies), "version": built["version"], "formats": {}}
+    for name, (payload, decode) in variants.items():
+        seconds = decode_seconds(decode, args.number)
+        results["formats"][name] = {
+            "bytes": len(payload),
+            "ratio": round(len(payload) / len(day_json), 3),
+            "decode_ms": round(seconds * 1000, 2),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import time
+
+COMPARED_FIELDS = ("phone", "address", "lat", "long")
+
+
+def content_hash(value) -> str:
+    canonical = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def pharmacy_key(record: dict) -> tuple:
+    return record["district"], record["name"]
+
+
+def diff_records(previous: list, current: list) -> dict:
+    # A pharmacy is identified by district and name; anything else that
+    # moves between versions is reported as a changed field.
+    before = {pharmacy_key(record): record for record in previous}
+    after = {pharmacy_key(record): record for record in current}
+    changed = []
+    for key, record in after.items():
+        if key in before:
+            fields = [field for field in COMPARED_FIELDS if before[key].get(field) != record.get(field)]
+            if fields:
+                changed.append({"name": record["name"], "district": record["district"], "fields": fields})
+
+    return {
+        "added": [{"name": name, "district": district} for district, name in after.keys() - before.keys()],
+        "removed": [{"name": name, "district": district} for district, name in before.keys() - after.keys()],
+        "changed": changed,
+    }
+
+
+def change_entry(plaka_kodu: str, previous_hash, current_hash: str, previous: list, current: list) -> dict:
+    return {
+        "plaka": plaka_kodu,
+        "at": int(time.time()),
+        "previous": previous_hash,
+        "hash": current_hash,
+        "count": len(current),
+        **diff_records(previous or [], current),
+    }
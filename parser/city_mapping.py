@@ -82,10 +82,34 @@ CITY_MAPPING = {
     "81": "DÜZCE"
 }
 
+# Plate codes from the most to the least populous province.
+POPULATION_ORDER = [
+    "34", "6", "35", "16", "7", "42", "1", "63", "27", "41", "33", "21",
+    "31", "45", "38", "55", "10", "46", "65", "9", "20", "54", "48", "59",
+    "26", "44", "61", "25", "47", "3", "58", "52", "72", "43", "2", "80",
+    "32", "73", "23", "60", "19", "64", "17", "68", "81", "67", "22", "49",
+    "51", "4", "66", "39", "28", "37", "53", "56", "13", "12", "14", "71",
+    "70", "50", "40", "24", "77", "5", "30", "76", "15", "11", "78", "57",
+    "8", "36", "74", "29", "79", "18", "75", "62", "69",
+]
+
+ASCII_FOLD = str.maketrans("İŞĞÜÖÇ", "ISGUOC")
+
+def upper_tr(text: str) -> str:
+    return text.strip().replace("i", "İ").replace("ı", "I").upper()
+
+def fold_city_name(city_name: str) -> str:
+    return upper_tr(city_name).translate(ASCII_FOLD)
+
 CITY_NAME_TO_CODE = {v: k for k, v in CITY_MAPPING.items()}
+CITY_FOLDED_TO_CODE = {fold_city_name(v): k for k, v in CITY_MAPPING.items()}
 
 def get_city_name(plaka_kodu: str) -> str:
     return CITY_MAPPING.get(plaka_kodu, None)
 
 def get_plaka_code(city_name: str) -> str:
-    return CITY_NAME_TO_CODE.get(city_name.upper(), None) 
\ No newline at end of file
+    # Accepts any case, and names typed without Turkish letters.
+    return CITY_NAME_TO_CODE.get(upper_tr(city_name)) or CITY_FOLDED_TO_CODE.get(fold_city_name(city_name))
+
+def by_population(plaka_codes) -> list:
+    return sorted(plaka_codes, key=POPULATION_ORDER.index) 
\ No newline at end of file
@@ -0,0 +1,180 @@
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.join("cache", "coordinates.sqlite3")
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 50000
+PRUNE_EVERY = 500
+
+
+def normalize_text(text: str) -> str:
+    return " ".join((text or "").split()).casefold()
+
+
+def make_key(name: str, district: str, address: str) -> str:
+    return "|".join(normalize_text(part) for part in (name, district, address))
+
+
+class CoordinateCache:
+    def __init__(self, path=DEFAULT_PATH, ttl_days=DEFAULT_TTL_DAYS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS coordinates (
+                key TEXT PRIMARY KEY,
+                lat REAL NOT NULL,
+                long REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_coordinates_used_at ON coordinates (used_at)")
+        self.conn.commit()
+        self.prune()
+
+    def get(self, name: str, district: str, address: str):
+        key = make_key(name, district, address)
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT lat, long FROM coordinates WHERE key = ? AND updated_at >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute("UPDATE coordinates SET used_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            return row[0], row[1]
+
+    def set(self, name: str, district: str, address: str, lat: float, lon: float) -> None:
+        if lat is None or lon is None:
+            return
+
+        key = make_key(name, district, address)
+        now = time.time()
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO coordinates (key, lat, long, updated_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, lat, lon, now, now),
+            )
+            self.conn.commit()
+            self.writes += 1
+            should_prune = self.writes % PRUNE_EVERY == 0
+
+        if should_prune:
+            self.prune()
+
+    def discard(self, name: str, district: str, address: str) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM coordinates WHERE key = ?", (make_key(name, district, address),))
+            self.conn.commit()
+
+    def prune(self) -> int:
+        with self.lock:
+            expired = self.conn.execute(
+                "DELETE FROM coordinates WHERE updated_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+            overflow = self.conn.execute(
+                """
+                DELETE FROM coordinates WHERE key IN (
+                    SELECT key FROM coordinates ORDER BY used_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            ).rowcount
+            self.conn.commit()
+        return expired + overflow
+
+    def size(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM coordinates").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups * 100, 1) if lookups else 0,
+            "size": self.size(),
+        }
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class BatchCache:
+    # Sits in front of the shared cache for one city's multi-date batch, so
+    # pharmacies on duty again later in the batch never hit the map page,
+    # even with the persistent cache turned off.
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.known = {}
+
+    def get(self, name: str, district: str, address: str):
+        key = make_key(name, district, address)
+        if key in self.known:
+            return self.known[key]
+        cached = self.cache.get(name, district, address) if self.cache else None
+        if cached:
+            self.known[key] = cached
+        return cached
+
+    def set(self, name: str, district: str, address: str, lat: float, lon: float) -> None:
+        if lat is None or lon is None:
+            return
+        self.known[make_key(name, district, address)] = (lat, lon)
+        if self.cache:
+            self.cache.set(name, district, address, lat, lon)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+
+    path = os.getenv("COORD_CACHE_PATH", DEFAULT_PATH)
+    if not path:
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            try:
+                ttl_days = int(os.getenv("COORD_CACHE_TTL_DAYS", DEFAULT_TTL_DAYS))
+            except ValueError:
+                ttl_days = DEFAULT_TTL_DAYS
+            try:
+                _cache = CoordinateCache(path, ttl_days)
+            except sqlite3.Error as e:
+                print(f"✗ Coordinate cache unavailable: {e}")
+                return None
+        return _cache
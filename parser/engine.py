@@ -0,0 +1,157 @@
+import asyncio
+import os
+import queue
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from parser import parser, parser_dates
+
+import async_parser
+
+ENGINES = ("thread", "async")
+DEFAULT_ENGINE = "thread"
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = {"thread": 8, "async": 32}
+
+FAILED_RESULT = {"success": False, "tooktime": 0, "count": 0, "list": []}
+
+
+def get_engine() -> str:
+    engine = os.getenv("PARSER_ENGINE", DEFAULT_ENGINE).lower()
+    return engine if engine in ENGINES else DEFAULT_ENGINE
+
+
+def get_concurrency(engine: str = DEFAULT_ENGINE) -> int:
+    try:
+        concurrency = int(os.getenv("PARSER_CONCURRENCY", DEFAULT_CONCURRENCY))
+    except ValueError:
+        concurrency = DEFAULT_CONCURRENCY
+    return max(1, min(concurrency, MAX_CONCURRENCY[engine]))
+
+
+def city_callback(on_list, plaka_kodu: str):
+    return partial(on_list, plaka_kodu) if on_list else None
+
+
+def run_cities_threaded(tarih: str, plaka_codes, max_workers: int, on_list=None):
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="city") as executor:
+        futures = {
+            executor.submit(parser, plaka_kodu, tarih, city_callback(on_list, plaka_kodu)): plaka_kodu
+            for plaka_kodu in plaka_codes
+        }
+        for future in as_completed(futures):
+            plaka_kodu = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                result = dict(FAILED_RESULT)
+            yield plaka_kodu, result
+
+
+def run_cities_async(tarih: str, plaka_codes, max_workers: int, on_list=None):
+    plaka_codes = list(plaka_codes)
+    results = queue.Queue()
+
+    async def sweep():
+        semaphore = asyncio.Semaphore(max_workers)
+        pool = async_parser.create_pool(max_workers)
+
+        async def scrape(plaka_kodu):
+            async with semaphore:
+                try:
+                    result = await async_parser.parser(
+                        plaka_kodu, tarih, city_callback(on_list, plaka_kodu), pool
+                    )
+                except Exception:
+                    result = dict(FAILED_RESULT)
+            results.put((plaka_kodu, result))
+
+        try:
+            await asyncio.gather(*(scrape(plaka_kodu) for plaka_kodu in plaka_codes))
+        finally:
+            await async_parser.close_pool(pool)
+
+    # The event loop lives on its own thread so callers can keep consuming
+    # results with a plain for loop, exactly like the threaded engine.
+    loop_thread = threading.Thread(target=asyncio.run, args=(sweep(),), daemon=True)
+    loop_thread.start()
+    for _ in plaka_codes:
+        yield results.get()
+    loop_thread.join()
+
+
+def run_batches_threaded(batches: dict, max_workers: int, on_list=None):
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="city") as executor:
+        futures = {
+            executor.submit(parser_dates, plaka_kodu, dates, city_callback(on_list, plaka_kodu)): plaka_kodu
+            for plaka_kodu, dates in batches.items()
+        }
+        for future in as_completed(futures):
+            plaka_kodu = futures[future]
+            try:
+                results = future.result()
+            except Exception:
+                results = {}
+            for tarih in batches[plaka_kodu]:
+                yield plaka_kodu, tarih, results.get(tarih) or dict(FAILED_RESULT)
+
+
+def run_batches_async(batches: dict, max_workers: int, on_list=None):
+    results = queue.Queue()
+
+    async def sweep():
+        semaphore = asyncio.Semaphore(max_workers)
+        pool = async_parser.create_pool(max_workers)
+
+        async def scrape(plaka_kodu, dates):
+            async with semaphore:
+                try:
+                    city_results = await async_parser.parser_dates(
+                        plaka_kodu, dates, city_callback(on_list, plaka_kodu), pool
+                    )
+                except Exception:
+                    city_results = {}
+            for tarih in dates:
+                results.put((plaka_kodu, tarih, city_results.get(tarih) or dict(FAILED_RESULT)))
+
+        try:
+            await asyncio.gather(*(scrape(plaka_kodu, dates) for plaka_kodu, dates in batches.items()))
+        finally:
+            await async_parser.close_pool(pool)
+
+    loop_thread = threading.Thread(target=asyncio.run, args=(sweep(),), daemon=True)
+    loop_thread.start()
+    for _ in range(sum(len(dates) for dates in batches.values())):
+        yield results.get()
+    loop_thread.join()
+
+
+def parse_city(plaka_kodu: str, tarih: str, on_list=None, engine: str = None) -> dict:
+    # One city on the calling thread; the async engine runs it on an event
+    # loop of its own.
+    if (engine or get_engine()) == "async":
+        return asyncio.run(async_parser.parser(plaka_kodu, tarih, on_list))
+    return parser(plaka_kodu, tarih, on_list)
+
+
+def run_cities(tarih: str, plaka_codes, max_workers: int = None, engine: str = None, on_list=None):
+    # on_list(plaka_kodu, pharmacies) is called from the worker as soon as a
+    # city's table is parsed and again while its coordinates are filled in.
+    engine = engine or get_engine()
+    max_workers = max_workers or get_concurrency(engine)
+
+    if engine == "async":
+        return run_cities_async(tarih, plaka_codes, max_workers, on_list)
+    return run_cities_threaded(tarih, plaka_codes, max_workers, on_list)
+
+
+def run_city_batches(batches: dict, max_workers: int = None, engine: str = None, on_list=None):
+    # batches maps a plate code to the dates to scrape for it, in order.
+    # Yields (plaka_kodu, tarih, result) once a whole city batch is done;
+    # on_list(plaka_kodu, tarih, pharmacies) fires as each list is parsed.
+    engine = engine or get_engine()
+    max_workers = max_workers or get_concurrency(engine)
+
+    if engine == "async":
+        return run_batches_async(batches, max_workers, on_list)
+    return run_batches_threaded(batches, max_workers, on_list)
@@ -0,0 +1,58 @@
+import re
+
+from lxml import html as lxml_html
+
+TOKEN_PATTERN = re.compile(rb"<body\b[^>]*?\bdata-token=[\"']([^\"']*)[\"']", re.IGNORECASE)
+TABLE_START_PATTERN = re.compile(rb"<table\b[^>]*?\bid=[\"']searchTable[\"']", re.IGNORECASE)
+TABLE_END = b"</table>"
+QUERY_FORM_PATTERN = re.compile(rb"<select\b[^>]*?\bname=[\"']plakaKodu[\"']", re.IGNORECASE)
+LAT_PATTERN = re.compile(rb"var latti = parseFloat\(([\d\.]+)\);")
+LON_PATTERN = re.compile(rb"var longi = parseFloat\(([\d\.]+)\);")
+
+HTML_PARSER = lxml_html.HTMLParser(encoding="utf-8", remove_comments=True)
+
+
+def extract_token(content: bytes) -> str:
+    match = TOKEN_PATTERN.search(content)
+    return match.group(1).decode("utf-8") if match else None
+
+
+def is_query_form(content: bytes) -> bool:
+    # A submit answered with the query form means the token was rejected.
+    return QUERY_FORM_PATTERN.search(content) is not None
+
+
+def cell_text(cell) -> str:
+    # Same output as BeautifulSoup's get_text(strip=True).
+    return "".join(text.strip() for text in cell.itertext())
+
+
+def extract_rows(content: bytes) -> list:
+    # Only the #searchTable markup is handed to lxml; the rest of the page
+    # is never parsed. Rows come back as plain tuples of cell texts.
+    start = TABLE_START_PATTERN.search(content)
+    if not start:
+        return []
+
+    end = content.find(TABLE_END, start.start())
+    fragment = content[start.start():end + len(TABLE_END)] if end != -1 else content[start.start():]
+    table = lxml_html.fromstring(fragment, parser=HTML_PARSER)
+    if table.tag != "table":
+        table = table.find(".//table")
+        if table is None:
+            return []
+
+    return [
+        tuple(cell_text(cell) for cell in row.iterfind("td"))
+        for row in table.iterfind("tbody/tr")
+    ]
+
+
+def extract_coordinates(content: bytes):
+    lat_match = LAT_PATTERN.search(content)
+    if not lat_match:
+        return None, None
+    lon_match = LON_PATTERN.search(content, lat_match.end())
+    if not lon_match:
+        return None, None
+    return float(lat_match.group(1)), float(lon_match.group(1))
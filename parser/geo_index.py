@@ -0,0 +1,144 @@
+import math
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+# Precision 5 tiles are about 4.9 x 4.9 km, precision 4 about 39 x 19.5 km.
+# Readers try the fine tiles first and widen only when too few are found.
+TILE_PRECISIONS = (5, 4)
+DEFAULT_NEAREST = 10
+EARTH_RADIUS_KM = 6371.0
+
+
+def encode(lat: float, lon: float, precision: int) -> str:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(geohash) < precision:
+        value, bounds = (lon, lon_range) if even else (lat, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(geohash)
+
+
+def decode_box(geohash: str):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lon_range if even else lat_range
+            middle = (bounds[0] + bounds[1]) / 2
+            if value >> shift & 1:
+                bounds[0] = middle
+            else:
+                bounds[1] = middle
+            even = not even
+
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def neighborhood(lat: float, lon: float, precision: int) -> list:
+    # The tile holding the point plus its eight neighbours, centre first.
+    min_lat, max_lat, min_lon, max_lon = decode_box(encode(lat, lon, precision))
+    lat_step = max_lat - min_lat
+    lon_step = max_lon - min_lon
+    center_lat = (min_lat + max_lat) / 2
+    center_lon = (min_lon + max_lon) / 2
+
+    tiles = []
+    for lat_offset in (0, -1, 1):
+        for lon_offset in (0, -1, 1):
+            tile = encode(
+                max(-90.0, min(90.0, center_lat + lat_offset * lat_step)),
+                (center_lon + lon_offset * lon_step + 180.0) % 360.0 - 180.0,
+                precision,
+            )
+            if tile not in tiles:
+                tiles.append(tile)
+    return tiles
+
+
+def covered_radius_km(lat: float, lon: float, precision: int) -> float:
+    # Any pharmacy closer than this is guaranteed to sit in neighborhood().
+    min_lat, max_lat, min_lon, max_lon = decode_box(encode(lat, lon, precision))
+    lat_step = max_lat - min_lat
+    lon_step = max_lon - min_lon
+    lat_margin = min(lat - (min_lat - lat_step), (max_lat + lat_step) - lat)
+    lon_margin = min(lon - (min_lon - lon_step), (max_lon + lon_step) - lon)
+    km_per_degree = math.pi * EARTH_RADIUS_KM / 180
+    return min(lat_margin * km_per_degree, lon_margin * km_per_degree * math.cos(math.radians(abs(lat) + lat_step)))
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def tiles_index(precision: int) -> str:
+    return f"tiles:{precision}"
+
+
+def district_field(record: dict) -> str:
+    return f"{record['city']}|{record['district']}"
+
+
+def build_index(pharmacies: list) -> dict:
+    # Index name -> {field: records}. Each index is stored as a hash next to
+    # the date key, e.g. "<date>:tiles:5" or "<date>:districts".
+    index = {tiles_index(precision): {} for precision in TILE_PRECISIONS}
+    index["districts"] = {}
+
+    for record in pharmacies:
+        index["districts"].setdefault(district_field(record), []).append(record)
+        if record.get("lat") is None or record.get("long") is None:
+            continue
+        for precision in TILE_PRECISIONS:
+            tile = encode(float(record["lat"]), float(record["long"]), precision)
+            index[tiles_index(precision)].setdefault(tile, []).append(record)
+
+    return index
+
+
+def rank(records: list, lat: float, lon: float) -> list:
+    ranked = []
+    for record in records:
+        if record.get("lat") is None or record.get("long") is None:
+            continue
+        ranked.append(dict(record, distance=round(distance_km(lat, lon, float(record["lat"]), float(record["long"])), 3)))
+    ranked.sort(key=lambda record: record["distance"])
+    return ranked
+
+
+def nearest(read_tiles, lat: float, lon: float, limit: int = DEFAULT_NEAREST, read_all=None) -> list:
+    # read_tiles(index_name, fields) -> {field: records}. Stops at the first
+    # precision whose neighbourhood provably holds the closest `limit`.
+    for precision in TILE_PRECISIONS:
+        tiles = read_tiles(tiles_index(precision), neighborhood(lat, lon, precision))
+        ranked = rank([record for records in tiles.values() for record in records or []], lat, lon)
+        if len(ranked) >= limit and ranked[limit - 1]["distance"] <= covered_radius_km(lat, lon, precision):
+            return ranked[:limit]
+
+    if read_all is None:
+        return ranked[:limit]
+    return rank(read_all(), lat, lon)[:limit]
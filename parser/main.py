@@ -1,25 +1,39 @@
-import json
+import argparse
+import os
+import threading
 import time
-import gc
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from parser import parser
-from city_mapping import get_city_name
-from upstash_redis import Redis
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-
-def get_redis_client():
-    try:
-        return Redis(
-            url=os.getenv("UPSTASH_REDIS_REST_URL"),
-            token=os.getenv("UPSTASH_REDIS_REST_TOKEN"),
-        )
-    except Exception as e:
-        print(f"✗ Redis connection failed: {e}")
-        return None
+from engine import ENGINES, city_callback, get_concurrency, get_engine, parse_city, run_cities, run_city_batches
+from city_mapping import by_population, get_city_name
+from coord_cache import get_cache
+import metrics
+from rate_limiter import get_limiter
+from resilience import get_breaker, get_retry_budget
+from scheduler import SweepPlanner, active_day
+from session_pool import get_session_pool
+from storage import (
+    ALL_PLAKA_CODES,
+    BACKENDS,
+    STATUS_DONE,
+    STATUS_EARLY,
+    STATUS_FAILED,
+    STATUS_PARTIAL,
+    get_redis_client,
+    get_storage,
+    pending_cities,
+    publish_day,
+    record_progress,
+    save_city,
+    save_draft,
+)
+from work_queue import get_work_queue, new_worker_id, parse_job
+
+
+MODES = ("scheduler", "coordinator", "worker", "prefetch")
+DEFAULT_PREFETCH_DAYS = 2
+SCHEDULER_TICK = 600
+WORKER_IDLE_SLEEP = 10
 
 
 def get_turkish_time():
@@ -32,121 +46,198 @@ def format_date(date_obj):
     return date_obj.strftime("%d/%m/%Y")
 
 
-def redis_has_data(redis_client, date_key):
-    try:
-        if not redis_client:
-            return False
-        existing_data = redis_client.get(date_key)
-        if existing_data:
-            data = json.loads(existing_data)
-            if len(data) == 0:
-                return False
-            
-            cities_found = set()
-            required_cities = {get_city_name("1").title(), get_city_name("45").title(), get_city_name("81").title()}
-            
-            for pharmacy in data:
-                city = pharmacy.get("city", "")
-                if city in required_cities:
-                    cities_found.add(city)
-            
-            return len(cities_found) == 3
-        return False
-    except Exception as e:
-        print(f"✗ Redis check error: {e}")
-        return False
+def list_publisher(storage, date_str):
+    if not storage:
+        return None
+
+    def publish_list(plaka_str, pharmacies):
+        # Early list for the website; the final save replaces it.
+        if save_draft(storage, date_str, plaka_str, pharmacies):
+            missing_coords = sum(1 for p in pharmacies if not p.has_coordinates())
+            record_progress(
+                storage, date_str, plaka_str, STATUS_PARTIAL, len(pharmacies), missing_coords
+            )
+
+    return publish_list
+
 
+def batch_publisher(storage):
+    if not storage:
+        return None
+
+    def publish_list(plaka_str, date_str, pharmacies):
+        list_publisher(storage, date_str)(plaka_str, pharmacies)
+
+    return publish_list
+
+
+def handle_city_result(storage, date_str, plaka_str, result, label, early=False):
+    city_name = get_city_name(plaka_str)
+    status = STATUS_FAILED
+    storage_started = time.perf_counter()
+
+    print(f"{label}: {city_name} ({plaka_str})", end=" ... ")
 
-def save_to_redis(redis_client, date_key, plaka_kodu, pharmacies):
     try:
-        if not redis_client:
-            return False
-
-        city_name = get_city_name(plaka_kodu).title()
-        redis_data = []
-
-        for pharmacy in pharmacies:
-            redis_data.append(
-                {
-                    "city": city_name,
-                    "district": pharmacy.get("İlçe", ""),
-                    "name": pharmacy.get("Ad", ""),
-                    "phone": pharmacy.get("Telefon", ""),
-                    "address": pharmacy.get("Adres", ""),
-                    "lat": pharmacy.get("Lat"),
-                    "long": pharmacy.get("Long"),
-                }
+        if result["success"] and result["list"]:
+            # Check coordinate quality for reporting
+            missing_coords = sum(1 for p in result["list"] if not p.has_coordinates())
+            coord_info = ""
+            if missing_coords > 0:
+                coord_percentage = ((result["count"] - missing_coords) / result["count"]) * 100
+                coord_info = f", {coord_percentage:.0f}% coords"
+            
+            saved = save_city(
+                storage, date_str, plaka_str, result["list"]
             )
-
-        existing_data = redis_client.get(date_key)
-        if existing_data:
-            existing_list = json.loads(existing_data)
-            existing_list.extend(redis_data)
-            redis_client.set(
-                date_key, json.dumps(existing_list, ensure_ascii=False), ex=604800
+            if saved:
+                status = STATUS_PARTIAL if missing_coords else STATUS_DONE
+                status = STATUS_EARLY if early else status
+            record_progress(
+                storage, date_str, plaka_str, status, result["count"], missing_coords, final=True
             )
+            saved_status = "✓" if saved else "✗"
+            print(f"✓ {result['count']} pharmacies ({result['tooktime']}s{coord_info}) Stored:{saved_status}")
+        elif result["success"] and result["count"] == 0:
+            # Empty result (already retried if suspicious)
+            saved = save_city(storage, date_str, plaka_str, [])
+            status = (STATUS_EARLY if early else STATUS_DONE) if saved else STATUS_FAILED
+            record_progress(storage, date_str, plaka_str, status)
+            print(f"✓ 0 pharmacies ({result['tooktime']}s)")
         else:
-            redis_client.set(
-                date_key, json.dumps(redis_data, ensure_ascii=False), ex=604800
-            )
+            record_progress(storage, date_str, plaka_str, STATUS_FAILED)
+            print(f"✗ Failed ({result['tooktime']}s)")
 
-        return True
-    except Exception:
-        return False
+    except Exception as e:
+        record_progress(storage, date_str, plaka_str, STATUS_FAILED)
+        print(f"✗ Error: {e}")
+
+    metrics.log_city(
+        date_str,
+        plaka_str,
+        city_name,
+        result,
+        status,
+        storage_seconds=round(time.perf_counter() - storage_started, 3),
+    )
+    return status
+
+
+def print_sweep_stats(engine):
+    limiter_stats = get_limiter().stats()
+    print(
+        f"🚦 Rate limiter: {limiter_stats['rate']} req/s, {limiter_stats['requests']} requests, "
+        f"{limiter_stats['throttled']} throttled, {limiter_stats['errors']} errors, "
+        f"{limiter_stats['waited']}s waited"
+    )
+
+    budget_stats = get_retry_budget().stats()
+    breaker_stats = get_breaker().stats()
+    print(
+        f"🛟 Retries: {budget_stats['spent']} spent, {budget_stats['denied']} denied by budget; "
+        f"breaker {breaker_stats['state']}, opened {breaker_stats['opened']}x, {breaker_stats['paused']}s paused"
+    )
+
+    if engine == "thread":
+        session_stats = get_session_pool().stats()
+        print(
+            f"🔁 Sessions: {session_stats['reused']} reused, {session_stats['created']} created "
+            f"({session_stats['reuse_rate']}% reuse), {session_stats['dropped']} dropped"
+        )
+
+    cache = get_cache()
+    if cache:
+        stats = cache.stats()
+        print(
+            f"📍 Coordinate cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']}% hit rate), {stats['size']} entries"
+        )
+        cache.reset_stats()
 
 
-def process_single_date(redis_client, date_str):
+def process_single_date(storage, date_str, engine=None, plaka_codes=None):
     successful = 0
     failed = 0
+    engine = engine or get_engine()
+    concurrency = get_concurrency(engine)
+    plaka_codes = plaka_codes or ALL_PLAKA_CODES
+    total = len(plaka_codes)
 
     print(f"Starting pharmacy data collection for {date_str}")
-    print(f"Redis connection: {'✓ Connected' if redis_client else '✗ Not connected'}")
+    print(f"Storage: {'✓ ' + storage.name if storage else '✗ Not connected'}")
+    print(f"Engine: {engine}, concurrency: {concurrency} cities, {total} to process")
     print("=" * 60)
 
-    for plaka_kodu in range(1, 82):
-        plaka_str = str(plaka_kodu)
-        city_name = get_city_name(plaka_str)
+    on_list = list_publisher(storage, date_str)
 
-        print(f"Processing {plaka_kodu:2d}/81: {city_name} ({plaka_str})", end=" ... ")
+    for done, (plaka_str, result) in enumerate(
+        run_cities(date_str, plaka_codes, concurrency, engine, on_list), start=1
+    ):
+        status = handle_city_result(
+            storage, date_str, plaka_str, result, f"Processed {done:2d}/{total}"
+        )
+        if status == STATUS_FAILED:
+            failed += 1
+        else:
+            successful += 1
 
-        try:
-            result = parser(plaka_str, date_str)
-
-            if result["success"] and result["list"]:
-                # Check coordinate quality for reporting
-                missing_coords = sum(1 for p in result["list"] if not p.get("Lat") or not p.get("Long"))
-                coord_info = ""
-                if missing_coords > 0:
-                    coord_percentage = ((result["count"] - missing_coords) / result["count"]) * 100
-                    coord_info = f", {coord_percentage:.0f}% coords"
-                
-                redis_saved = save_to_redis(
-                    redis_client, date_str, plaka_str, result["list"]
-                )
-                redis_status = "✓" if redis_saved else "✗"
-                print(f"✓ {result['count']} pharmacies ({result['tooktime']}s{coord_info}) Redis:{redis_status}")
-                successful += 1
-            elif result["success"] and result["count"] == 0:
-                # Empty result (already retried if suspicious)
-                print(f"✓ 0 pharmacies ({result['tooktime']}s)")
-                successful += 1
-            else:
-                print(f"✗ Failed ({result['tooktime']}s)")
-                failed += 1
+    print(f"\n📊 FINAL RESULTS: ✓ {successful} successful, ✗ {failed} failed")
 
-        except Exception as e:
-            print(f"✗ Error: {e}")
-            failed += 1
+    published = publish_day(storage, date_str)
+    print(f"Published {date_str}: {'✓' if published else '✗'}")
+
+    print_sweep_stats(engine)
+
+
+def process_date_batch(storage, pending, engine=None, early=False):
+    # pending maps each date to its unfinished cities. Every city runs all
+    # of its dates back to back in one session, sharing coordinate lookups.
+    # With early, successful cities are stored as early. Returns
+    # {date: {plaka: status}}.
+    engine = engine or get_engine()
+    concurrency = get_concurrency(engine)
+    batches = {}
+    for date_str, plaka_codes in pending.items():
+        for plaka_str in plaka_codes:
+            batches.setdefault(plaka_str, []).append(date_str)
+    batches = {plaka_str: batches[plaka_str] for plaka_str in by_population(batches)}
+    total = sum(len(dates) for dates in batches.values())
+    outcome = {date_str: [0, 0] for date_str in pending}
+    statuses = {date_str: {} for date_str in pending}
+
+    print(f"Starting batch collection for {', '.join(pending)}")
+    print(f"Storage: {'✓ ' + storage.name if storage else '✗ Not connected'}")
+    print(f"Engine: {engine}, concurrency: {concurrency} cities, {len(batches)} cities, {total} city-days")
+    print("=" * 60)
 
-        time.sleep(2)
-        gc.collect()
+    for done, (plaka_str, date_str, result) in enumerate(
+        run_city_batches(batches, concurrency, engine, batch_publisher(storage)), start=1
+    ):
+        status = handle_city_result(
+            storage, date_str, plaka_str, result, f"Processed {done:3d}/{total} {date_str}", early
+        )
+        statuses[date_str][plaka_str] = status
+        if status == STATUS_FAILED:
+            outcome[date_str][1] += 1
+        else:
+            outcome[date_str][0] += 1
+
+    print()
+    for date_str, (successful, failed) in outcome.items():
+        published = publish_day(storage, date_str)
+        print(
+            f"📊 {date_str}: ✓ {successful} successful, ✗ {failed} failed, "
+            f"published: {'✓' if published else '✗'}"
+        )
 
-    print(f"\n📊 FINAL RESULTS: ✓ {successful} successful, ✗ {failed} failed")
+    print_sweep_stats(engine)
+    return statuses
 
 
-def process_multiple_dates(days=2):
-    redis_client = get_redis_client()
+def process_multiple_dates(days=2, engine=None, work_queue=None, storage=None, batch=False):
+    storage = storage or get_storage()
     current_date = get_turkish_time()
+    batched = {}
 
     for day_offset in range(days):
         target_date = current_date + timedelta(days=day_offset)
@@ -154,14 +245,28 @@ def process_multiple_dates(days=2):
 
         print(f"\nChecking date: {date_str}")
 
-        if redis_has_data(redis_client, date_str):
+        plaka_codes = pending_cities(storage, date_str)
+        if not plaka_codes:
             print(f"✓ Data already exists for {date_str} - SKIPPING")
             continue
 
-        print(f"✗ No data found for {date_str} - PROCESSING")
+        if work_queue:
+            added = work_queue.enqueue(date_str, plaka_codes)
+            print(f"📬 Queued {added} new jobs for {date_str} ({len(plaka_codes)} cities pending)")
+            continue
+
+        if batch:
+            print(f"↻ {date_str}: {len(plaka_codes)} cities pending - BATCHED")
+            batched[date_str] = plaka_codes
+            continue
+
+        if len(plaka_codes) < len(ALL_PLAKA_CODES):
+            print(f"↻ Resuming {date_str}: {len(plaka_codes)} cities left - PROCESSING")
+        else:
+            print(f"✗ No data found for {date_str} - PROCESSING")
 
         try:
-            process_single_date(redis_client, date_str)
+            process_single_date(storage, date_str, engine, plaka_codes)
             print(f"✓ Completed processing for {date_str}")
         except KeyboardInterrupt:
             print(f"\n\nProcess interrupted by user while processing {date_str}")
@@ -172,20 +277,89 @@ def process_multiple_dates(days=2):
 
         print("-" * 60)
 
+    if batched:
+        process_date_batch(storage, batched, engine)
+
+
+def prefetch_ahead(storage, engine, days):
+    # Idle with every planned date complete: scrape the dates after the
+    # upcoming one now, batched per city, so the sweep for each of them only
+    # checks the lists again with cached coordinates. Cities are stored as
+    # early, which keeps them pending for that check. A date whose biggest
+    # unscraped city comes back empty is not published upstream yet, and
+    # nothing past it is tried.
+    first = active_day(get_turkish_time()) + timedelta(days=2)
+    pending = {}
+    for offset in range(days):
+        date_str = format_date(first + timedelta(days=offset))
+        plaka_codes = pending_cities(storage, date_str, early=False)
+        if not plaka_codes:
+            continue
 
-def run_scheduler():
+        result = parse_city(plaka_codes[0], date_str, engine=engine)
+        if not result["success"] or not result["count"]:
+            print(f"⏸ {date_str} is not published upstream yet, prefetch stops here")
+            break
+        handle_city_result(storage, date_str, plaka_codes[0], result, f"Prefetch {date_str}", early=True)
+        if plaka_codes[1:]:
+            pending[date_str] = plaka_codes[1:]
+
+    if pending:
+        process_date_batch(storage, pending, engine, early=True)
+    return pending
+
+
+def run_scheduler(engine=None, work_queue=None, storage=None):
+    storage = storage or get_storage()
+    planner = SweepPlanner(storage)
+    announced = None
+    prefetched = None
 
     while True:
         try:
             current_time = get_turkish_time()
+            plan = planner.plan(current_time)
+            planner.write_plan(plan)
+            run_at = datetime.fromisoformat(plan["next_run"])
+
+            if run_at > current_time:
+                # Idle with every date complete: scrape the days after the
+                # upcoming one once per rollover. Coordinators leave this to
+                # the prefetch mode so workers stay the only scrapers.
+                if not work_queue and plan["date"] is None and prefetched != plan["next_rollover"]:
+                    prefetch_ahead(storage, engine, int(os.getenv("PREFETCH_DAYS", DEFAULT_PREFETCH_DAYS)))
+                    prefetched = plan["next_rollover"]
+                    continue
+
+                if plan["next_run"] != announced:
+                    print(
+                        f"\n🗓 Next run at {run_at.strftime('%d/%m/%Y %H:%M')} (UTC+3) "
+                        f"for {plan['date'] or '-'}: {plan['reason']}"
+                    )
+                    announced = plan["next_run"]
+                time.sleep(min((run_at - current_time).total_seconds(), SCHEDULER_TICK))
+                continue
+
+            if work_queue:
+                # Coordinator mode: workers do the scraping, the plan only
+                # decides what goes on the queue and when.
+                added = work_queue.enqueue(plan["date"], plan["cities"])
+                print(
+                    f"\n📬 Queued {added} new jobs for {plan['date']} "
+                    f"({len(plan['cities'])} cities pending, {plan['reason']})"
+                )
+                planner.record_sweep(plan["date"], 0, 0, get_turkish_time())
+                continue
+
             print(
-                f"\n🕐 Starting collection at: {current_time.strftime('%d/%m/%Y %H:%M:%S')} (UTC+3)"
+                f"\n🕐 Starting collection at: {current_time.strftime('%d/%m/%Y %H:%M:%S')} (UTC+3) "
+                f"for {plan['date']}, {len(plan['cities'])} cities ({plan['reason']})"
+            )
+            started = time.time()
+            process_single_date(storage, plan["date"], engine, plan["cities"])
+            planner.record_sweep(
+                plan["date"], len(plan["cities"]), time.time() - started, get_turkish_time()
             )
-
-            process_multiple_dates(2)
-
-
-            time.sleep(43200)
 
         except KeyboardInterrupt:
             print("\n\n🛑 Scheduler stopped by user.")
@@ -196,9 +370,119 @@ def run_scheduler():
             time.sleep(600)
 
 
+def keep_lease(work_queue, job, worker_id, stop):
+    while not stop.wait(work_queue.lease_seconds / 3):
+        try:
+            if not work_queue.heartbeat(job, worker_id):
+                print(f"⚠️ Lease lost for {job}")
+                return
+        except Exception as e:
+            print(f"✗ Heartbeat error for {job}: {e}")
+
+
+def work_on_queue(storage, work_queue, worker_id, engine):
+    while True:
+        job = work_queue.lease(worker_id)
+        if not job:
+            time.sleep(WORKER_IDLE_SLEEP)
+            continue
+
+        date_str, plaka_str = parse_job(job)
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=keep_lease, args=(work_queue, job, worker_id, stop), daemon=True
+        )
+        heartbeat.start()
+        status = STATUS_FAILED
+        try:
+            on_list = city_callback(list_publisher(storage, date_str), plaka_str)
+            result = parse_city(plaka_str, date_str, on_list, engine)
+            status = handle_city_result(storage, date_str, plaka_str, result, f"[{worker_id}] {date_str}")
+        except Exception as e:
+            print(f"✗ Error on {job}: {e}")
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        remaining = work_queue.finish(job, worker_id, retry=status == STATUS_FAILED)
+        if remaining == 0:
+            published = publish_day(storage, date_str)
+            print(f"Published {date_str}: {'✓' if published else '✗'}")
+
+
+def run_worker(work_queue, concurrency=None, storage=None, engine=None):
+    storage = storage or get_storage()
+    engine = engine or get_engine()
+    concurrency = concurrency or get_concurrency(engine)
+    worker_id = os.getenv("WORKER_ID") or new_worker_id()
+
+    print(f"👷 Worker {worker_id} started with {concurrency} {engine} slots")
+    # Each slot leases its own job; the heartbeat thread renews the lease so
+    # a worker that dies simply lets its cities expire back onto the queue.
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="worker") as executor:
+        slots = [
+            executor.submit(work_on_queue, storage, work_queue, f"{worker_id}/{slot}", engine)
+            for slot in range(concurrency)
+        ]
+        for slot in slots:
+            slot.result()
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Nöbetçi eczane scraper")
+    arg_parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default=get_engine(),
+        help="scraping engine to use (default: $PARSER_ENGINE or thread)",
+    )
+    arg_parser.add_argument(
+        "--mode",
+        choices=MODES,
+        default=os.getenv("PARSER_MODE", "scheduler"),
+        help="scheduler scrapes by itself, coordinator only fills the work queue, "
+        "worker leases cities from it, prefetch scrapes the next --days once "
+        "(default: $PARSER_MODE or scheduler)",
+    )
+    arg_parser.add_argument(
+        "--days",
+        type=int,
+        default=int(os.getenv("PREFETCH_DAYS", DEFAULT_PREFETCH_DAYS)),
+        help="days to prefetch, batched per city (default: $PREFETCH_DAYS or 2)",
+    )
+    arg_parser.add_argument(
+        "--queue",
+        choices=("redis", "file"),
+        default=os.getenv("WORK_QUEUE", "redis"),
+        help="work queue backend for coordinator/worker modes (default: $WORK_QUEUE or redis)",
+    )
+    arg_parser.add_argument(
+        "--storage",
+        choices=BACKENDS,
+        default=os.getenv("STORAGE_BACKEND", "redis"),
+        help="where scraped lists are stored (default: $STORAGE_BACKEND or redis)",
+    )
+    return arg_parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    metrics.start_metrics_server()
+    storage = get_storage(args.storage)
     try:
-        run_scheduler()
+        if args.mode == "scheduler":
+            run_scheduler(args.engine, storage=storage)
+        elif args.mode == "prefetch":
+            process_multiple_dates(args.days, args.engine, storage=storage, batch=True)
+        else:
+            work_queue = get_work_queue(args.queue, get_redis_client())
+            if work_queue is None:
+                print("✗ Work queue unavailable")
+                return
+            if args.mode == "coordinator":
+                run_scheduler(args.engine, work_queue, storage)
+            else:
+                run_worker(work_queue, storage=storage, engine=args.engine)
     except KeyboardInterrupt:
         print("\n\nProcess interrupted by user.")
     except Exception as e:
@@ -206,4 +490,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,133 +1,177 @@
 #!/usr/bin/env python3
 
+import argparse
 import json
-from datetime import datetime, timedelta, timezone
-from parser import parser
-from city_mapping import get_city_name
-from upstash_redis import Redis
 import os
-from dotenv import load_dotenv
+import sys
+from datetime import datetime, timedelta
 
-load_dotenv()
+from city_mapping import by_population, get_city_name, get_plaka_code
+from engine import ENGINES, get_engine
+from main import format_date, get_turkish_time, process_date_batch
+from storage import ALL_PLAKA_CODES, BACKENDS, STATUS_FAILED, get_storage, pending_cities
 
-CITY_CODE = ""
+EXIT_OK = 0
+EXIT_FAILED = 1
+DATE_FORMAT = "%d/%m/%Y"
 
-def get_redis_client():
-    try:
-        return Redis(
-            url=os.getenv("UPSTASH_REDIS_REST_URL"),
-            token=os.getenv("UPSTASH_REDIS_REST_TOKEN"),
-        )
-    except Exception as e:
-        print(f"✗ Redis connection failed: {e}")
-        return None
-
-def get_turkish_time():
-    turkish_tz = timezone(timedelta(hours=3))
-    utc_now = datetime.now(timezone.utc)
-    return utc_now.astimezone(turkish_tz)
-
-def format_date(date_obj):
-    return date_obj.strftime("%d/%m/%Y")
-
-def save_to_redis(redis_client, date_key, plaka_kodu, pharmacies):
-    try:
-        if not redis_client:
-            return False
-
-        city_name = get_city_name(plaka_kodu).title()
-        redis_data = []
-
-        for pharmacy in pharmacies:
-            redis_data.append(
-                {
-                    "city": city_name,
-                    "district": pharmacy.get("İlçe", ""),
-                    "name": pharmacy.get("Ad", ""),
-                    "phone": pharmacy.get("Telefon", ""),
-                    "address": pharmacy.get("Adres", ""),
-                    "lat": pharmacy.get("Lat"),
-                    "long": pharmacy.get("Long"),
-                }
-            )
-
-        existing_data = redis_client.get(date_key)
-        if existing_data:
-            existing_list = json.loads(existing_data)
-            existing_list.extend(redis_data)
-            redis_client.set(
-                date_key, json.dumps(existing_list, ensure_ascii=False), ex=604800
-            )
-        else:
-            redis_client.set(
-                date_key, json.dumps(redis_data, ensure_ascii=False), ex=604800
-            )
-
-        return True
-    except Exception as e:
-        print(f"✗ Redis save error: {e}")
-        return False
-
-def manual_scrape():
-    print("🏥 Manual Pharmacy Data Collection")
-    print("=" * 50)
-    
-    redis_client = get_redis_client()
-    print(f"Redis connection: {'✓ Connected' if redis_client else '✗ Not connected'}")
-    
-    current_time = get_turkish_time()
-    date_str = format_date(current_time)
-    
-    print(f"Date: {date_str}")
-    print(f"Time: {current_time.strftime('%H:%M:%S')} (UTC+3)")
-    print("-" * 50)
-    
-    plaka_kodu = CITY_CODE
-    city_name = get_city_name(plaka_kodu)
-    
-    print(f"Processing: {city_name} (code: {plaka_kodu})")
-    print("Fetching pharmacy data...", end=" ")
-    
+EXAMPLES = """examples:
+  manual.py 35                              today's list for İzmir
+  manual.py 1-5,34,ankara --dates +1        five cities, İstanbul and Ankara for tomorrow
+  manual.py all --dates 13/06/2025..15/06/2025 --pending
+  manual.py izmir,bursa --dates today,+1 --dry-run
+"""
+
+
+def parse_cities(value: str) -> list:
+    # Plate codes, ranges like 1-5, city names (Turkish letters optional)
+    # or "all".
+    codes = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part.lower() == "all":
+            codes.extend(ALL_PLAKA_CODES)
+            continue
+        start, separator, end = part.partition("-")
+        if start.isdigit() and (not separator or end.isdigit()):
+            codes.extend(str(code) for code in range(int(start), int(end or start) + 1))
+            continue
+        plaka_kodu = get_plaka_code(part)
+        if plaka_kodu is None:
+            raise argparse.ArgumentTypeError(f"unknown city: {part}")
+        codes.append(plaka_kodu)
+
+    invalid = [code for code in codes if code not in ALL_PLAKA_CODES]
+    if invalid:
+        raise argparse.ArgumentTypeError(f"invalid plate codes: {', '.join(invalid)}")
+    return list(dict.fromkeys(codes))
+
+
+def parse_day(value: str, today):
+    if value == "today":
+        return today
+    if value == "tomorrow":
+        return today + timedelta(days=1)
+    if value[:1] in "+-" and value[1:].isdigit():
+        return today + timedelta(days=int(value))
     try:
-        result = parser(plaka_kodu, date_str)
-        
-        if result["success"] and result["list"]:
-            print(f"✓ Found {result['count']} pharmacies ({result['tooktime']}s)")
-            
-            # Save to Redis (Upstash)
-            print("Saving to Upstash Redis...", end=" ")
-            redis_saved = save_to_redis(redis_client, date_str, plaka_kodu, result["list"])
-            
-            if redis_saved:
-                print("✓ Successfully saved to Upstash")
-                print("\nSummary:")
-                print(f"- City: {city_name}")
-                print(f"- Date: {date_str}")
-                print(f"- Pharmacies: {result['count']}")
-                print(f"- Processing time: {result['tooktime']}s")
-                print(f"- Redis key: {date_str}")
-                print("- Data expires in: 7 days")
-            else:
-                print("✗ Failed to save to Upstash")
-                return False
-        else:
-            print("✗ Failed to fetch pharmacy data")
-            return False
-            
-    except Exception as e:
-        print(f"✗ Error: {e}")
-        return False
-    
-    return True
+        return datetime.strptime(value, DATE_FORMAT).date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date: {value} (use dd/mm/yyyy, today, tomorrow or +N)")
+
+
+def parse_dates(value: str) -> list:
+    # Comma separated dates, offsets from today and first..last ranges.
+    today = get_turkish_time().date()
+    dates = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, separator, last = part.partition("..")
+        first = parse_day(first, today)
+        last = parse_day(last, today) if separator else first
+        if last < first:
+            raise argparse.ArgumentTypeError(f"empty date range: {part}")
+        dates.extend(first + timedelta(days=offset) for offset in range((last - first).days + 1))
+    return list(dict.fromkeys(format_date(day) for day in dates))
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(
+        description="Scrape chosen cities for chosen dates with the scheduler's engine",
+        epilog=EXAMPLES,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    arg_parser.add_argument("cities", type=parse_cities, help="plate codes, ranges, city names or all, comma separated")
+    arg_parser.add_argument(
+        "--dates", type=parse_dates, default="today", help="dates, +N offsets or first..last ranges (default: today)"
+    )
+    arg_parser.add_argument(
+        "--pending", action="store_true", help="skip cities already stored as done for each date"
+    )
+    arg_parser.add_argument("--dry-run", action="store_true", help="print the jobs instead of running them")
+    arg_parser.add_argument("--output", help="also write the plan or the per-city report as JSON to this file")
+    arg_parser.add_argument("--engine", choices=ENGINES, default=get_engine())
+    arg_parser.add_argument("--concurrency", type=int, help="cities scraped in parallel (default: $PARSER_CONCURRENCY)")
+    arg_parser.add_argument("--storage", choices=BACKENDS, default=os.getenv("STORAGE_BACKEND", "redis"))
+    return arg_parser.parse_args()
+
+
+def build_plan(storage, dates: list, plaka_codes: list, only_pending: bool) -> dict:
+    plan = {}
+    for date_str in dates:
+        codes = plaka_codes
+        if only_pending:
+            pending = set(pending_cities(storage, date_str))
+            codes = [plaka_kodu for plaka_kodu in plaka_codes if plaka_kodu in pending]
+        if codes:
+            plan[date_str] = by_population(codes)
+    return plan
+
+
+def write_report(report: dict, output: str = None) -> None:
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+
+
+def job_list(plan: dict, statuses: dict = None) -> list:
+    return [
+        {
+            "date": date_str,
+            "plaka": plaka_kodu,
+            "city": get_city_name(plaka_kodu),
+            **({"status": statuses.get(date_str, {}).get(plaka_kodu, STATUS_FAILED)} if statuses is not None else {}),
+        }
+        for date_str, plaka_codes in plan.items()
+        for plaka_kodu in plaka_codes
+    ]
+
+
+def main() -> int:
+    args = parse_args()
+    if args.concurrency:
+        os.environ["PARSER_CONCURRENCY"] = str(args.concurrency)
+
+    storage = get_storage(args.storage) if args.pending or not args.dry_run else None
+    plan = build_plan(storage, args.dates, args.cities, args.pending)
+    total = sum(len(plaka_codes) for plaka_codes in plan.values())
+
+    if args.dry_run:
+        report = {"dry_run": True, "engine": args.engine, "jobs": job_list(plan)}
+        write_report(report, args.output)
+        if args.output:
+            print(f"📝 {total} city-days planned, written to {args.output}")
+        return EXIT_OK
+
+    if not plan:
+        print("✓ Nothing to do, every requested city is already stored")
+        return EXIT_OK
+
+    statuses = process_date_batch(storage, plan, args.engine)
+    jobs = job_list(plan, statuses)
+    failed = [job for job in jobs if job["status"] == STATUS_FAILED]
+
+    print()
+    for job in jobs:
+        mark = "✗" if job["status"] == STATUS_FAILED else "✓"
+        print(f"{mark} {job['date']} {job['city']} ({job['plaka']}): {job['status']}")
+    print(f"\n{'❌' if failed else '🎉'} {total - len(failed)}/{total} city-days stored")
+
+    if args.output:
+        write_report({"dry_run": False, "engine": args.engine, "jobs": jobs}, args.output)
+    return EXIT_FAILED if failed else EXIT_OK
+
 
 if __name__ == "__main__":
     try:
-        success = manual_scrape()
-        if success:
-            print("\n🎉 Pharmacy data successfully collected and saved to Upstash!")
-        else:
-            print("\n❌ Failed to collect pharmacy data")
+        sys.exit(main())
     except KeyboardInterrupt:
         print("\n\n🛑 Process interrupted by user")
-    except Exception as e:
-        print(f"\n❌ Unexpected error: {e}")
\ No newline at end of file
+        sys.exit(130)
@@ -0,0 +1,303 @@
+import asyncio
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 9108
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+PREFIX = "nobetcim_"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{PREFIX}{name}{format_labels(labels)} {value:g}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(
+                            f"{PREFIX}{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}"
+                        )
+                    lines.append(f"{PREFIX}{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {histogram.total:.6f}")
+                    lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "counters": {
+                    name + format_labels(labels): value for (name, labels), value in self.counters.items()
+                },
+                "histograms": {
+                    name + format_labels(labels): {"count": h.count, "sum": round(h.total, 3)}
+                    for (name, labels), h in self.histograms.items()
+                },
+            }
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+registry = MetricsRegistry()
+
+
+class CityStats:
+    __slots__ = ("plaka_kodu", "tarih", "requests", "retries", "bytes", "coord_hits", "coord_lookups", "phases")
+
+    def __init__(self, plaka_kodu: str, tarih: str):
+        self.plaka_kodu = plaka_kodu
+        self.tarih = tarih
+        self.requests = 0
+        self.retries = 0
+        self.bytes = 0
+        self.coord_hits = 0
+        self.coord_lookups = 0
+        self.phases = {}
+
+    def as_dict(self) -> dict:
+        coords = self.coord_hits + self.coord_lookups
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "coord_hits": self.coord_hits,
+            "coord_lookups": self.coord_lookups,
+            "coord_hit_rate": round(self.coord_hits / coords * 100, 1) if coords else 0,
+            "phases": {phase: round(seconds, 3) for phase, seconds in self.phases.items()},
+        }
+
+
+# Context variables follow both worker threads and asyncio tasks, so each
+# city's numbers land on its own CityStats in either engine.
+current_city = ContextVar("current_city", default=None)
+
+
+@contextmanager
+def city_scope(plaka_kodu: str, tarih: str):
+    stats = CityStats(plaka_kodu, tarih)
+    token = current_city.set(stats)
+    try:
+        yield stats
+    finally:
+        current_city.reset(token)
+
+
+def observe_phase(phase: str, seconds: float) -> None:
+    registry.observe("phase_seconds", seconds, phase=phase)
+    city = current_city.get()
+    if city is not None:
+        city.phases[phase] = city.phases.get(phase, 0.0) + seconds
+
+
+def timed(phase: str):
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe_phase(phase, time.perf_counter() - started)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe_phase(phase, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def endpoint_name(url: str) -> str:
+    if "harita=" in url:
+        return "map"
+    if "nobetci=" in url:
+        return "rows"
+    if "?submit" in url:
+        return "submit"
+    return "token"
+
+
+def count_request(url: str, status, size: int = 0) -> None:
+    endpoint = endpoint_name(url)
+    registry.inc("requests_total", endpoint=endpoint, status=status)
+    if size:
+        registry.inc("response_bytes_total", size, endpoint=endpoint)
+    city = current_city.get()
+    if city is not None:
+        city.requests += 1
+        city.bytes += size
+
+
+def count_retry(kind: str) -> None:
+    registry.inc("retries_total", kind=kind)
+    city = current_city.get()
+    if city is not None:
+        city.retries += 1
+
+
+def count_write(kind: str, result: str) -> None:
+    registry.inc("storage_writes_total", kind=kind, result=result)
+
+
+def count_retry_denied(kind: str, reason: str) -> None:
+    registry.inc("retries_denied_total", kind=kind, reason=reason)
+
+
+def count_validation(check: str, result: str, count: int = 1) -> None:
+    registry.inc("validation_total", count, check=check, result=result)
+
+
+def count_breaker(event: str) -> None:
+    registry.inc("breaker_total", event=event)
+
+
+def count_session(event: str) -> None:
+    registry.inc("sessions_total", event=event)
+
+
+def count_coordinate(source: str) -> None:
+    registry.inc("coordinates_total", source=source)
+    city = current_city.get()
+    if city is not None:
+        if source == "cache":
+            city.coord_hits += 1
+        else:
+            city.coord_lookups += 1
+
+
+def sleep(seconds: float) -> None:
+    observe_phase("sleep", seconds)
+    time.sleep(seconds)
+
+
+async def sleep_async(seconds: float) -> None:
+    observe_phase("sleep", seconds)
+    await asyncio.sleep(seconds)
+
+
+def log_city(tarih: str, plaka_kodu: str, city_name: str, result: dict, status: str, **extra) -> None:
+    line = {
+        "event": "city",
+        "date": tarih,
+        "plaka": plaka_kodu,
+        "city": city_name,
+        "status": status,
+        "count": result.get("count", 0),
+        "tooktime": result.get("tooktime", 0),
+        **result.get("metrics", {}),
+        **extra,
+    }
+    registry.inc("cities_total", status=status)
+    registry.observe("city_seconds", result.get("tooktime", 0))
+    print(json.dumps(line, ensure_ascii=False))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics"):
+            body = registry.render().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.startswith("/stats"):
+            body = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: int = None):
+    if port is None:
+        try:
+            port = int(os.getenv("METRICS_PORT", DEFAULT_PORT))
+        except ValueError:
+            port = DEFAULT_PORT
+    if not port:
+        return None
+
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    except OSError as e:
+        print(f"✗ Metrics endpoint unavailable: {e}")
+        return None
+
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
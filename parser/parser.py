@@ -1,11 +1,25 @@
 import requests
-from bs4 import BeautifulSoup
-import re
+import contextvars
+import os
 import time
-from functools import wraps
-import gc
+from contextlib import ExitStack
+from functools import partial, wraps
 
-BASE_URL = "https://www.turkiye.gov.tr/saglik-titck-nobetci-eczane-sorgulama"
+import metrics
+from coord_cache import BatchCache, get_cache
+from extract import extract_coordinates, extract_rows, extract_token, is_query_form
+from pharmacy import Pharmacy
+from rate_limiter import get_limiter
+from resilience import DeadlineExceeded, attempt_scope, before_request, deadline_scope, record_outcome, retry
+from session_pool import TokenExpired, get_session_pool
+
+BASE_URL = os.getenv(
+    "PARSER_BASE_URL", "https://www.turkiye.gov.tr/saglik-titck-nobetci-eczane-sorgulama"
+)
+
+COORD_RETRY_ROUNDS = 2
+COORD_RETRY_BUDGET = 20
+COORD_PUBLISH_EVERY = 20
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0",
@@ -15,23 +29,11 @@ HEADERS = {
     "Accept-Encoding": "gzip, deflate",
 }
 
-session = requests.Session()
-session.headers.update(HEADERS)
-
-
-def clean_phone_number(phone_text):
-    if not phone_text:
-        return ""
-
-    digits_only = re.sub(r"[^\d]", "", phone_text)
-
-    if digits_only.startswith("0") and len(digits_only) == 11:
-        return digits_only
-
-    if len(digits_only) == 10:
-        return "0" + digits_only
 
-    return phone_text
+def create_session() -> requests.Session:
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    return session
 
 
 def retry_on_failure(retries=5):
@@ -40,11 +42,11 @@ def retry_on_failure(retries=5):
         def wrapper(*args, **kwargs):
             for attempt in range(1, retries + 1):
                 try:
-                    return func(*args, **kwargs)
+                    with attempt_scope(attempt):
+                        return func(*args, **kwargs)
                 except requests.RequestException:
-                    if attempt == retries:
+                    if attempt == retries or not retry("request", attempt):
                         raise
-                    time.sleep(5)
             return None
 
         return wrapper
@@ -53,206 +55,344 @@ def retry_on_failure(retries=5):
 
 
 @retry_on_failure()
-def make_request(url: str, method: str = "GET", **kwargs) -> requests.Response:
-    kwargs.setdefault("timeout", 5)
+def make_request(session: requests.Session, url: str, method: str = "GET", **kwargs) -> requests.Response:
+    kwargs["timeout"] = before_request(kwargs.get("timeout", 5))
     kwargs.setdefault("stream", True)
-    if method.upper() == "GET":
-        response = session.get(url, **kwargs)
-    else:
-        response = session.post(url, **kwargs)
+    limiter = get_limiter()
+    started = time.monotonic()
+    limiter.acquire()
+    metrics.observe_phase("rate_wait", time.monotonic() - started)
+    started = time.monotonic()
+    try:
+        if method.upper() == "GET":
+            response = session.get(url, **kwargs)
+        else:
+            response = session.post(url, **kwargs)
+    except requests.RequestException:
+        limiter.record(time.monotonic() - started, error=True)
+        record_outcome(error=True)
+        metrics.count_request(url, "error")
+        raise
+    limiter.record(time.monotonic() - started, response.status_code)
+    record_outcome(response.status_code)
+    size = int(response.headers.get("Content-Length") or 0) if kwargs["stream"] else len(response.content)
+    metrics.count_request(url, response.status_code, size)
     response.raise_for_status()
     return response
 
 
-def fetch_token() -> str:
-    response = make_request(BASE_URL, stream=False)
-    try:
-        soup = BeautifulSoup(response.content, "lxml")
-    except:
-        soup = BeautifulSoup(response.content, "html.parser")
-    
-    token = soup.body.get("data-token") if soup.body else None
+@metrics.timed("token")
+def fetch_token(session: requests.Session) -> str:
+    response = make_request(session, BASE_URL, stream=False)
+    token = extract_token(response.content)
     response.close()
-    del soup, response
-    gc.collect()
     return token
 
 
-def submit_query(plaka_kodu: str, tarih: str, token: str) -> None:
+@metrics.timed("submit")
+def submit_query(session: requests.Session, plaka_kodu: str, tarih: str, token: str) -> str:
     payload = {
         "plakaKodu": plaka_kodu,
         "nobetTarihi": tarih,
         "token": token,
         "btn": "Sorgula",
     }
-    response = make_request(f"{BASE_URL}?submit", method="POST", data=payload, stream=False)
+    response = make_request(session, f"{BASE_URL}?submit", method="POST", data=payload, stream=False)
+    content = response.content
     response.close()
-    del response
-    gc.collect()
+    if is_query_form(content):
+        raise TokenExpired(extract_token(content))
+    return extract_token(content)
 
 
-def fetch_pharmacy_rows() -> list:
-    response = make_request(f"{BASE_URL}?nobetci=Eczaneler", stream=False)
+def query_city(pooled, plaka_kodu: str, tarih: str) -> None:
+    # Only a brand-new session pays for the landing page. A rejected token
+    # comes back with a fresh one on the same page, so one resubmit is enough.
+    if pooled.token is None:
+        pooled.remember(fetch_token(pooled.session))
     try:
-        soup = BeautifulSoup(response.content, "lxml")
-    except:
-        soup = BeautifulSoup(response.content, "html.parser")
-    
-    table = soup.find("table", {"id": "searchTable"})
-    rows = table.find("tbody").find_all("tr") if table else []
-    
+        pooled.remember(submit_query(pooled.session, plaka_kodu, tarih, pooled.token))
+    except TokenExpired as expired:
+        metrics.count_retry("token")
+        pooled.token = expired.token or fetch_token(pooled.session)
+        try:
+            pooled.remember(submit_query(pooled.session, plaka_kodu, tarih, pooled.token))
+        except TokenExpired:
+            requery_fresh(pooled, plaka_kodu, tarih)
+    pooled.queries += 1
+
+
+def requery_fresh(pooled, plaka_kodu: str, tarih: str) -> None:
+    # Rejected twice: start over on a brand-new session. If even that submit
+    # looks like the query form, is_query_form() is misreading the page, so
+    # the results page decides instead of the attempt being thrown away.
+    metrics.count_session("replaced")
+    pooled.session.close()
+    pooled.session = create_session()
+    pooled.token = fetch_token(pooled.session)
+    try:
+        pooled.remember(submit_query(pooled.session, plaka_kodu, tarih, pooled.token))
+    except TokenExpired as rejected:
+        metrics.count_session("form_after_submit")
+        pooled.remember(rejected.token)
+
+
+@metrics.timed("rows")
+def fetch_pharmacy_rows(session: requests.Session) -> list:
+    response = make_request(session, f"{BASE_URL}?nobetci=Eczaneler", stream=False)
+    rows = extract_rows(response.content)
     response.close()
-    del soup, response, table
-    gc.collect()
     return rows
 
 
-def get_coordinates(index: int, max_retries=3):
+@metrics.timed("coordinates")
+def get_coordinates(session: requests.Session, index: int, max_retries=3):
     url_coord = f"{BASE_URL}?harita=Goster&index={index}"
     payload = {"harita": "Goster", "index": str(index)}
 
     for attempt in range(max_retries):
         try:
-            response = make_request(url_coord, method="POST", data=payload, stream=False)
-            content = response.text
+            with attempt_scope(attempt + 1):
+                response = make_request(session, url_coord, method="POST", data=payload, stream=False)
+            lat, lon = extract_coordinates(response.content)
             response.close()
-            
-            time.sleep(1)
 
-            lat_match = re.search(r"var latti = parseFloat\(([\d\.]+)\);", content)
-            lon_match = re.search(r"var longi = parseFloat\(([\d\.]+)\);", content)
+            if lat is not None:
+                metrics.count_coordinate("lookup")
+                return lat, lon
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            pass
 
-            del response, content
-            gc.collect()
+        if attempt == max_retries - 1 or not retry("coordinate", attempt + 1):
+            break
 
-            if lat_match and lon_match:
-                return float(lat_match.group(1)), float(lon_match.group(1))
-            else:
-                if attempt < max_retries - 1:
-                    backoff_delay = (attempt + 1) * 2 
-                    time.sleep(backoff_delay)
-                    continue
-                else:
-                    return None, None
-                    
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep((attempt + 1) * 2)
-                continue
-            else:
-                return None, None
-    
+    metrics.count_coordinate("miss")
     return None, None
 
 
+def cached_coordinates(cache, pharmacy: Pharmacy):
+    if cache is None:
+        return None
+    cached = cache.get(pharmacy.name, pharmacy.district, pharmacy.address)
+    if cached:
+        metrics.count_coordinate("cache")
+    return cached
+
+
+def cache_coordinates(cache, pharmacy: Pharmacy) -> None:
+    if cache is None:
+        return
+    cache.set(pharmacy.name, pharmacy.district, pharmacy.address, pharmacy.lat, pharmacy.long)
+
+
+def lookup_coordinates(session: requests.Session, cache, idx: int, pharmacy: Pharmacy, max_retries=3) -> None:
+    pharmacy.lat, pharmacy.long = get_coordinates(session, idx, max_retries=max_retries)
+    cache_coordinates(cache, pharmacy)
+
+
+def parse_pharmacies(rows, cache=None):
+    # Yields (index, pharmacy) per usable row, with cached coordinates
+    # already filled in. The index is the row's position for the map endpoint.
+    for idx, row in enumerate(rows):
+        pharmacy = Pharmacy.from_row(row)
+        if pharmacy is None:
+            continue
+        cached = cached_coordinates(cache, pharmacy)
+        if cached:
+            pharmacy.lat, pharmacy.long = cached
+        yield idx, pharmacy
+
+
+def retry_missing_coordinates(session: requests.Session, indexed_pharmacies: list, cache=None) -> int:
+    # Re-asks the map endpoint only for the rows that came back without
+    # coordinates, reusing the query already submitted on this session.
+    budget = COORD_RETRY_BUDGET
+    retried = 0
+
+    for retry_round in range(COORD_RETRY_ROUNDS):
+        missing = missing_coordinates(indexed_pharmacies)
+        if not missing or budget <= 0 or not retry("coordinate_round", retry_round + 1):
+            break
+
+        for idx, pharmacy in missing[:budget]:
+            with attempt_scope(retry_round + 2):
+                lookup_coordinates(session, cache, idx, pharmacy, max_retries=1)
+            budget -= 1
+            retried += 1
+
+    return retried
+
+
+def publish_list(on_list, indexed_pharmacies: list) -> None:
+    if on_list is None:
+        return
+    try:
+        on_list([p for _, p in indexed_pharmacies])
+    except Exception as e:
+        print(f"✗ List publish error: {e}")
+
+
 def is_suspicious_empty_result(plaka_kodu):
     return True
 
 
-def scrape_pharmacies(plaka_kodu: str, tarih: str, max_retries=3) -> dict:
+def missing_coordinates(indexed_pharmacies: list) -> list:
+    return [(idx, p) for idx, p in indexed_pharmacies if not p.has_coordinates()]
+
+
+def make_result(success: bool, start_time: float, pharmacies: list = None) -> dict:
+    pharmacies = pharmacies or []
+    return {
+        "success": success,
+        "tooktime": round(time.time() - start_time, 2),
+        "count": len(pharmacies),
+        "list": pharmacies,
+    }
+
+
+def scrape_pharmacies(plaka_kodu: str, tarih: str, max_retries=3, on_list=None, cache=None) -> dict:
     start_time = time.time()
+    cache = cache or get_cache()
+    pool = get_session_pool()
     
     for attempt in range(max_retries):
-        pharmacies = []
+        with attempt_scope(attempt + 1):
+            indexed_pharmacies = []
+            pooled = pool.acquire(create_session)
+            healthy = False
         
-        try:
-            token = fetch_token()
-            time.sleep(1)
-            submit_query(plaka_kodu, tarih, token)
-            time.sleep(1)
-            rows = fetch_pharmacy_rows()
-
-            for idx, row in enumerate(rows):
-                cols = [td.get_text(strip=True) for td in row.find_all("td")]
-                if len(cols) >= 4:
-                    name = cols[0]
-                    district = cols[1].split(" ")[0]
-                    phone = clean_phone_number(cols[2])
-                    address = cols[3]
-
-                    lat, lon = get_coordinates(idx)
-                    
-                    pharmacy_data = {
-                        "Ad": name,
-                        "İlçe": district,
-                        "Adres": address,
-                        "Telefon": phone,
-                        "Lat": lat,
-                        "Long": lon,
-                    }
-                    pharmacies.append(pharmacy_data)
-                    
-                    del cols, pharmacy_data
-                
-                del row
-
-            del rows, token
-            gc.collect()
-
-            if len(pharmacies) == 0:
-                if attempt < max_retries - 1:
-                    backoff_delay = 5 * (attempt + 1) 
-                    time.sleep(backoff_delay)
+            try:
+                query_city(pooled, plaka_kodu, tarih)
+                # query_city() may have swapped in a brand-new session.
+                session = pooled.session
+                indexed_pharmacies = list(parse_pharmacies(fetch_pharmacy_rows(session), cache))
+                pending = missing_coordinates(indexed_pharmacies)
+
+                if len(indexed_pharmacies) == 0:
+                    if attempt < max_retries - 1 and retry("city", attempt + 2):
+                        continue
+                    else:
+                        healthy = True
+                        return make_result(True, start_time)
+
+                # Stage one: the duty list goes out as soon as the table is
+                # parsed. Stage two fills coordinates in and republishes every
+                # COORD_PUBLISH_EVERY lookups.
+                publish_list(on_list, indexed_pharmacies)
+
+                for resolved, (idx, pharmacy) in enumerate(pending, start=1):
+                    lookup_coordinates(session, cache, idx, pharmacy)
+                    if resolved % COORD_PUBLISH_EVERY == 0 and resolved < len(pending):
+                        publish_list(on_list, indexed_pharmacies)
+
+                retry_missing_coordinates(session, indexed_pharmacies, cache)
+                healthy = True
+                return make_result(True, start_time, [p for _, p in indexed_pharmacies])
+
+            except DeadlineExceeded:
+                # Out of time: a parsed table is still worth saving, with the
+                # rows that lack coordinates reported as partial.
+                metrics.count_retry_denied("city", "deadline")
+                return make_result(bool(indexed_pharmacies), start_time, [p for _, p in indexed_pharmacies])
+            except Exception as e:
+                if attempt < max_retries - 1 and retry("city", attempt + 2):
                     continue
-                else:
-                    return {
-                        "success": True,
-                        "tooktime": round(time.time() - start_time, 2),
-                        "count": 0,
-                        "list": [],
-                    }
-            else:
-                missing_coords = sum(1 for p in pharmacies if not p.get("Lat") or not p.get("Long"))
-                coord_percentage = (len(pharmacies) - missing_coords) / len(pharmacies) * 100
-                
-                if coord_percentage < 50 and attempt < max_retries - 1:
-                    backoff_delay = 5 * (attempt + 1)
-                    time.sleep(backoff_delay)
-                    continue
-                else:
-                    return {
-                        "success": True,
-                        "tooktime": round(time.time() - start_time, 2),
-                        "count": len(pharmacies),
-                        "list": pharmacies,
-                    }
-
-        except Exception as e:
-            if attempt < max_retries - 1:
-                backoff_delay = 5 * (attempt + 1)  # 5s, 10s, 15s
-                time.sleep(backoff_delay)
-                continue
-            else:
-                del pharmacies
-                gc.collect()
-                return {
-                    "success": False,
-                    "tooktime": round(time.time() - start_time, 2),
-                    "count": 0,
-                    "list": [],
-                }
+                return make_result(False, start_time)
+            finally:
+                # An empty or failed attempt may mean a silently dead session,
+                # so only sessions that completed a city go back to the pool.
+                pool.release(pooled, healthy)
     
     # Should not reach here, but just in case
-    return {
-        "success": False,
-        "tooktime": round(time.time() - start_time, 2),
-        "count": 0,
-        "list": [],
-    }
+    return make_result(False, start_time)
 
 
-def parser(plaka_kodu: str, tarih: str) -> dict:
+def parser(plaka_kodu: str, tarih: str, on_list=None, cache=None) -> dict:
     try:
         if not plaka_kodu.isdigit() or not (1 <= int(plaka_kodu) <= 81):
             return {"success": False, "tooktime": 0, "count": 0, "list": []}
         else:
-            result = scrape_pharmacies(plaka_kodu, tarih)
-            gc.collect()
+            with metrics.city_scope(plaka_kodu, tarih) as stats, deadline_scope():
+                result = scrape_pharmacies(plaka_kodu, tarih, on_list=on_list, cache=cache)
+            result["metrics"] = stats.as_dict()
             return result
 
     except (IndexError, KeyboardInterrupt, Exception):
-        gc.collect()
         return {"success": False, "tooktime": 0, "count": 0, "list": []}
 
+def iter_pharmacies(plaka_kodu: str, tarih: str, cache=None, on_metrics=None):
+    # Streaming variant of parser(): yields each Pharmacy as soon as its
+    # coordinates are known, so callers that write or forward records one at
+    # a time never hold the whole city. It runs under the same city deadline
+    # and metrics scope; on_metrics gets the city's numbers when the stream
+    # ends. Errors propagate; there is no per-city retry here.
+    # The scopes are set in a copy of the context that is only entered while
+    # the stream works, so between items the caller's own context is in
+    # effect: its requests and time are not charged to this city.
+    context = contextvars.copy_context()
+    scopes = ExitStack()
+    stats = context.run(scopes.enter_context, metrics.city_scope(plaka_kodu, tarih))
+    context.run(scopes.enter_context, deadline_scope())
+    stream = stream_pharmacies(plaka_kodu, tarih, cache)
+    try:
+        while True:
+            try:
+                pharmacy = context.run(next, stream)
+            except StopIteration:
+                return
+            yield pharmacy
+    finally:
+        context.run(stream.close)
+        context.run(scopes.close)
+        if on_metrics is not None:
+            on_metrics(stats.as_dict())
+
+
+def stream_pharmacies(plaka_kodu: str, tarih: str, cache=None):
+    # Rows whose lookup failed are retried once the table is done and
+    # yielded last; past the deadline the rest go out without coordinates.
+    cache = cache or get_cache()
+    pool = get_session_pool()
+    pooled = pool.acquire(create_session)
+    healthy = False
+    try:
+        query_city(pooled, plaka_kodu, tarih)
+        session = pooled.session
+        pharmacies = parse_pharmacies(fetch_pharmacy_rows(session), cache)
+        missing = []
+        try:
+            for idx, pharmacy in pharmacies:
+                if not pharmacy.has_coordinates():
+                    missing.append((idx, pharmacy))
+                    lookup_coordinates(session, cache, idx, pharmacy)
+                    if not pharmacy.has_coordinates():
+                        continue
+                    missing.pop()
+                yield pharmacy
+            retry_missing_coordinates(session, missing, cache)
+        except DeadlineExceeded:
+            metrics.count_retry_denied("city", "deadline")
+            missing.extend(pharmacies)
+
+        for _, pharmacy in missing:
+            yield pharmacy
+        healthy = True
+    finally:
+        pool.release(pooled, healthy)
+
+
+def parser_dates(plaka_kodu: str, dates: list, on_list=None) -> dict:
+    # Queries the dates back to back: the pool hands the same warm session
+    # back after each date, and coordinates found for one date are reused
+    # for the others. on_list is called as on_list(tarih, pharmacies).
+    cache = BatchCache(get_cache())
+    return {
+        tarih: parser(plaka_kodu, tarih, partial(on_list, tarih) if on_list else None, cache)
+        for tarih in dates
+    }
+
+
 if __name__ == "__main__":
     print(parser("2", "13/06/2025"))
\ No newline at end of file
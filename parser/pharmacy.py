@@ -0,0 +1,59 @@
+import re
+
+
+def clean_phone_number(phone_text):
+    if not phone_text:
+        return ""
+
+    digits_only = re.sub(r"[^\d]", "", phone_text)
+
+    if digits_only.startswith("0") and len(digits_only) == 11:
+        return digits_only
+
+    if len(digits_only) == 10:
+        return "0" + digits_only
+
+    return phone_text
+
+
+class Pharmacy:
+    # One record per table row from parse to storage. Slots keep it at a
+    # fraction of a dict's size, and the English field names are the ones
+    # the stored records use, so nothing is copied on the way out.
+    __slots__ = ("name", "district", "phone", "address", "lat", "long")
+
+    def __init__(self, name, district, phone, address, lat=None, long=None):
+        self.name = name
+        self.district = district
+        self.phone = phone
+        self.address = address
+        self.lat = lat
+        self.long = long
+
+    @classmethod
+    def from_row(cls, cols: tuple):
+        if len(cols) < 4:
+            return None
+        return cls(cols[0], cols[1].split(" ")[0], clean_phone_number(cols[2]), cols[3])
+
+    def has_coordinates(self) -> bool:
+        return bool(self.lat and self.long)
+
+    def as_record(self, city: str) -> dict:
+        return {
+            "city": city,
+            "district": self.district,
+            "name": self.name,
+            "phone": self.phone,
+            "address": self.address,
+            "lat": self.lat,
+            "long": self.long,
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Pharmacy):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return f"Pharmacy({self.name!r}, {self.district!r}, lat={self.lat}, long={self.long})"
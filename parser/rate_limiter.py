@@ -0,0 +1,125 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+DEFAULT_RATE = 2.0
+DEFAULT_MIN_RATE = 0.2
+DEFAULT_MAX_RATE = 8.0
+BURST = 2
+ADDITIVE_INCREASE = 0.05
+MULTIPLICATIVE_DECREASE = 0.5
+SLOW_DECREASE = 0.9
+TARGET_LATENCY = 2.0
+DECREASE_COOLDOWN = 2.0
+MAX_RETRY_DELAY = 30
+
+
+class AdaptiveRateLimiter:
+    # Token bucket whose refill rate follows AIMD: every healthy response
+    # adds a little throughput, slow responses trim it, and 429/5xx or
+    # timeouts halve it (at most once per cooldown, since requests that were
+    # already in flight report the same incident).
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        min_rate=DEFAULT_MIN_RATE,
+        max_rate=DEFAULT_MAX_RATE,
+        burst=BURST,
+        target_latency=TARGET_LATENCY,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.target_latency = target_latency
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.waited = 0.0
+
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            self.requests += 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            self.waited += wait
+            return wait
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self.last_decrease < DECREASE_COOLDOWN:
+            return
+        self.last_decrease = now
+        self.rate = max(self.min_rate, self.rate * factor)
+
+    def record(self, latency: float, status_code: int = None, error: bool = False) -> None:
+        with self.lock:
+            if error or status_code == 429 or (status_code and status_code >= 500):
+                if status_code == 429:
+                    self.throttled += 1
+                else:
+                    self.errors += 1
+                self.decrease(MULTIPLICATIVE_DECREASE)
+            elif latency > self.target_latency:
+                self.decrease(SLOW_DECREASE)
+            else:
+                self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE)
+
+    def retry_delay(self, attempt: int) -> float:
+        # Exponential with equal jitter, so cities that failed together do
+        # not all come back in the same instant.
+        delay = min(MAX_RETRY_DELAY, 2 ** (attempt - 1) / self.rate)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "rate": round(self.rate, 2),
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "errors": self.errors,
+                "waited": round(self.waited, 1),
+            }
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> AdaptiveRateLimiter:
+    global _limiter
+
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveRateLimiter(
+                rate=env_float("PARSER_RATE", DEFAULT_RATE),
+                max_rate=env_float("PARSER_MAX_RATE", DEFAULT_MAX_RATE),
+            )
+        return _limiter
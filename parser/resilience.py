@@ -0,0 +1,265 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+from rate_limiter import env_float, get_limiter
+
+DEFAULT_CITY_DEADLINE = 180
+REQUEST_TIMEOUT = 5
+MIN_REQUEST_TIMEOUT = 0.5
+DEFAULT_RETRY_RATIO = 0.2
+RETRY_TOKENS = 20
+DEFAULT_BREAKER_THRESHOLD = 8
+DEFAULT_BREAKER_COOLDOWN = 15
+MAX_BREAKER_COOLDOWN = 300
+BREAKER_POLL = 0.5
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__("city deadline exceeded")
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def extend(self, seconds: float) -> None:
+        self.expires_at += seconds
+
+    def check(self) -> None:
+        if self.remaining() <= 0:
+            raise DeadlineExceeded()
+
+
+current_deadline = ContextVar("current_deadline", default=None)
+current_retry = ContextVar("current_retry", default=False)
+
+
+@contextmanager
+def deadline_scope(seconds: float = None):
+    # Every request, retry and backoff made for the city inside this scope
+    # is bounded by the same deadline.
+    deadline = Deadline(seconds if seconds is not None else env_float("PARSER_CITY_DEADLINE", DEFAULT_CITY_DEADLINE))
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+@contextmanager
+def attempt_scope(attempt: int):
+    # Requests made inside a retry (attempt > 1 here or in an enclosing
+    # scope) do not earn retry budget.
+    token = current_retry.set(attempt > 1 or current_retry.get())
+    try:
+        yield
+    finally:
+        current_retry.reset(token)
+
+
+class RetryBudget:
+    # Shared by every city: each first attempt earns `ratio` of a retry and
+    # each retry spends one, so when upstream is failing across the board
+    # retries stop instead of multiplying the load. Requests inside an
+    # attempt_scope() for a retry earn nothing.
+    def __init__(self, ratio=DEFAULT_RETRY_RATIO, capacity=RETRY_TOKENS):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.lock = threading.Lock()
+        self.spent = 0
+        self.denied = 0
+
+    def deposit(self) -> None:
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                self.denied += 1
+                return False
+            self.tokens -= 1
+            self.spent += 1
+            return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"tokens": round(self.tokens, 1), "spent": self.spent, "denied": self.denied}
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive connection errors or 5xx answers.
+    # While open every request waits, which pauses the whole sweep; after the
+    # cooldown a single probe goes out and either closes the breaker or
+    # reopens it with twice the cooldown.
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, cooldown=DEFAULT_BREAKER_COOLDOWN, max_cooldown=MAX_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.open_until = 0.0
+        self.probe_until = 0.0
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.paused = 0.0
+
+    def wait_time(self) -> float:
+        with self.lock:
+            if self.state == "closed":
+                return 0.0
+            now = time.monotonic()
+            if now < self.open_until:
+                return self.open_until - now
+            if now < self.probe_until:
+                return BREAKER_POLL
+            # A probe that never reported back (deadline, cancellation) does
+            # not hold the others forever.
+            self.state = "half_open"
+            self.probe_until = now + REQUEST_TIMEOUT + BREAKER_POLL
+            return 0.0
+
+    def open(self) -> None:
+        self.state = "open"
+        self.open_until = time.monotonic() + self.cooldown
+        self.probe_until = 0.0
+        self.opened += 1
+        metrics.count_breaker("open")
+        print(f"⛔ Upstream looks down, pausing requests for {self.cooldown:.0f}s")
+        self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+
+    def record(self, failure: bool) -> None:
+        with self.lock:
+            if not failure:
+                if self.state != "closed":
+                    metrics.count_breaker("close")
+                    print("✓ Upstream is answering again, resuming")
+                self.state = "closed"
+                self.failures = 0
+                self.probe_until = 0.0
+                self.cooldown = self.base_cooldown
+                return
+
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                self.open()
+
+    def add_pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused += seconds
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"state": self.state, "opened": self.opened, "paused": round(self.paused, 1)}
+
+
+_budget = None
+_breaker = None
+_lock = threading.Lock()
+
+
+def get_retry_budget() -> RetryBudget:
+    global _budget
+
+    with _lock:
+        if _budget is None:
+            _budget = RetryBudget(ratio=env_float("PARSER_RETRY_BUDGET", DEFAULT_RETRY_RATIO))
+        return _budget
+
+
+def get_breaker() -> CircuitBreaker:
+    global _breaker
+
+    with _lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                threshold=int(env_float("PARSER_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD)),
+                cooldown=env_float("PARSER_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN),
+            )
+        return _breaker
+
+
+def request_timeout(default: float = REQUEST_TIMEOUT) -> float:
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    deadline.check()
+    return max(MIN_REQUEST_TIMEOUT, min(default, deadline.remaining()))
+
+
+def paused(seconds: float) -> None:
+    # Time spent waiting on the breaker is the sweep's pause, not the city's
+    # own slowness, so it does not count against the deadline.
+    get_breaker().add_pause(seconds)
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.extend(seconds)
+
+
+def before_request(default: float = REQUEST_TIMEOUT) -> float:
+    breaker = get_breaker()
+    wait = breaker.wait_time()
+    while wait > 0:
+        time.sleep(wait)
+        paused(wait)
+        wait = breaker.wait_time()
+    if not current_retry.get():
+        get_retry_budget().deposit()
+    return request_timeout(default)
+
+
+async def before_request_async(default: float = REQUEST_TIMEOUT) -> float:
+    breaker = get_breaker()
+    wait = breaker.wait_time()
+    while wait > 0:
+        await asyncio.sleep(wait)
+        paused(wait)
+        wait = breaker.wait_time()
+    if not current_retry.get():
+        get_retry_budget().deposit()
+    return request_timeout(default)
+
+
+def record_outcome(status_code: int = None, error: bool = False) -> None:
+    get_breaker().record(error or bool(status_code and status_code >= 500))
+
+
+def retry_delay(kind: str, attempt: int):
+    # None when the retry is refused: either its backoff would run past the
+    # city's deadline or the shared budget is spent.
+    delay = get_limiter().retry_delay(attempt)
+    deadline = current_deadline.get()
+    if deadline is not None and delay >= deadline.remaining():
+        metrics.count_retry_denied(kind, "deadline")
+        return None
+    if not get_retry_budget().withdraw():
+        metrics.count_retry_denied(kind, "budget")
+        return None
+    metrics.count_retry(kind)
+    return delay
+
+
+def retry(kind: str, attempt: int) -> bool:
+    delay = retry_delay(kind, attempt)
+    if delay is None:
+        return False
+    metrics.sleep(delay)
+    return True
+
+
+async def retry_async(kind: str, attempt: int) -> bool:
+    delay = retry_delay(kind, attempt)
+    if delay is None:
+        return False
+    await metrics.sleep_async(delay)
+    return True
@@ -0,0 +1,119 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from storage import pending_cities
+
+TURKISH_TZ = timezone(timedelta(hours=3))
+ROLLOVER_HOUR = 8
+ROLLOVER_MINUTE = 30
+
+SAFETY_MARGIN = timedelta(hours=2)
+RETRY_INTERVAL = timedelta(minutes=15)
+IDLE_RECHECK = timedelta(hours=6)
+DEFAULT_SECONDS_PER_CITY = 30
+ESTIMATE_SMOOTHING = 0.3
+
+PLAN_PATH = os.path.join("logs", "schedule.json")
+
+
+def format_date(date_obj):
+    return date_obj.strftime("%d/%m/%Y")
+
+
+def rollover_on(day) -> datetime:
+    return datetime(day.year, day.month, day.day, ROLLOVER_HOUR, ROLLOVER_MINUTE, tzinfo=TURKISH_TZ)
+
+
+def active_day(now: datetime):
+    # Mirrors getCurrentActiveDate in the web API: before 08:30 the site
+    # still serves the previous day's duty list.
+    now = now.astimezone(TURKISH_TZ)
+    if now < rollover_on(now.date()):
+        return now.date() - timedelta(days=1)
+    return now.date()
+
+
+def next_rollover(now: datetime) -> datetime:
+    return rollover_on(active_day(now) + timedelta(days=1))
+
+
+class SweepPlanner:
+    def __init__(self, storage, plan_path=PLAN_PATH):
+        self.storage = storage
+        self.plan_path = plan_path
+        self.seconds_per_city = DEFAULT_SECONDS_PER_CITY
+        self.last_attempt = {}
+
+    def record_sweep(self, date_str: str, cities: int, seconds: float, finished_at: datetime) -> None:
+        self.last_attempt[date_str] = finished_at
+        if cities:
+            observed = seconds / cities
+            self.seconds_per_city += ESTIMATE_SMOOTHING * (observed - self.seconds_per_city)
+
+    def estimate(self, cities: int) -> timedelta:
+        return timedelta(seconds=cities * self.seconds_per_city)
+
+    def plan(self, now: datetime) -> dict:
+        now = now.astimezone(TURKISH_TZ)
+        deadline = next_rollover(now)
+        active = format_date(active_day(now))
+        upcoming = format_date(deadline.date())
+
+        targets = []
+        for date_str, due in ((active, now), (upcoming, deadline)):
+            pending = pending_cities(self.storage, date_str)
+            targets.append({"date": date_str, "due": due, "pending": pending})
+
+        run_at, reason, target = self.next_run(now, targets)
+        plan = {
+            "planned_at": now.isoformat(),
+            "next_rollover": deadline.isoformat(),
+            "seconds_per_city": round(self.seconds_per_city, 1),
+            "next_run": run_at.isoformat(),
+            "reason": reason,
+            "date": target["date"] if target else None,
+            "cities": target["pending"] if target else [],
+            "targets": [
+                {
+                    "date": t["date"],
+                    "due": t["due"].isoformat(),
+                    "pending": len(t["pending"]),
+                    "estimate_seconds": int(self.estimate(len(t["pending"])).total_seconds()),
+                }
+                for t in targets
+            ],
+        }
+        return plan
+
+    def next_run(self, now: datetime, targets: list):
+        active, upcoming = targets
+
+        if active["pending"]:
+            return self.retry_or_now(now, active, "active day is incomplete")
+
+        if upcoming["pending"]:
+            latest_start = upcoming["due"] - self.estimate(len(upcoming["pending"])) - SAFETY_MARGIN
+            if upcoming["date"] in self.last_attempt:
+                return self.retry_or_now(now, upcoming, "retrying failed cities before the rollover")
+            if latest_start <= now:
+                return now, "rollover deadline is close", upcoming
+            return latest_start, "planned backwards from the rollover", upcoming
+
+        return min(upcoming["due"], now + IDLE_RECHECK), "all dates complete", None
+
+    def retry_or_now(self, now: datetime, target: dict, reason: str):
+        last_attempt = self.last_attempt.get(target["date"])
+        if last_attempt and last_attempt + RETRY_INTERVAL > now:
+            return last_attempt + RETRY_INTERVAL, reason, target
+        return now, reason, target
+
+    def write_plan(self, plan: dict) -> None:
+        try:
+            directory = os.path.dirname(self.plan_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.plan_path, "w", encoding="utf-8") as f:
+                json.dump(plan, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"✗ Could not write schedule plan: {e}")
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+DEFAULT_POOL_SIZE = 8
+SESSION_MAX_IDLE = 300
+SESSION_MAX_QUERIES = 50
+
+
+class TokenExpired(Exception):
+    def __init__(self, token=None):
+        super().__init__("token rejected")
+        self.token = token
+
+
+class PooledSession:
+    def __init__(self, session):
+        self.session = session
+        self.token = None
+        self.queries = 0
+        self.last_used = time.monotonic()
+
+    def remember(self, token) -> None:
+        if token:
+            self.token = token
+
+
+class SessionPool:
+    # Idle sessions keep their cookie and last seen token, so the next city
+    # can submit straight away instead of loading the landing page again.
+    # close(session) is called for sessions the pool drops; without it they
+    # are kept in retired until drain(), for clients that close asynchronously.
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_idle=SESSION_MAX_IDLE, max_queries=SESSION_MAX_QUERIES, close=None):
+        self.size = size
+        self.max_idle = max_idle
+        self.max_queries = max_queries
+        self.close = close
+        self.idle = deque()
+        self.retired = []
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.dropped = 0
+
+    def usable(self, pooled: PooledSession) -> bool:
+        return (
+            pooled.token is not None
+            and pooled.queries < self.max_queries
+            and time.monotonic() - pooled.last_used < self.max_idle
+        )
+
+    def retire(self, pooled: PooledSession) -> None:
+        self.dropped += 1
+        metrics.count_session("dropped")
+        if self.close:
+            self.close(pooled.session)
+        else:
+            self.retired.append(pooled.session)
+
+    def acquire(self, factory) -> PooledSession:
+        with self.lock:
+            while self.idle:
+                pooled = self.idle.pop()
+                if self.usable(pooled):
+                    self.reused += 1
+                    metrics.count_session("reused")
+                    return pooled
+                self.retire(pooled)
+            self.created += 1
+
+        metrics.count_session("created")
+        return PooledSession(factory())
+
+    def release(self, pooled: PooledSession, healthy: bool = True) -> None:
+        pooled.last_used = time.monotonic()
+        with self.lock:
+            if healthy and len(self.idle) < self.size and self.usable(pooled):
+                self.idle.append(pooled)
+            else:
+                self.retire(pooled)
+
+    def drain(self) -> list:
+        with self.lock:
+            sessions = [pooled.session for pooled in self.idle] + self.retired
+            self.idle.clear()
+            self.retired = []
+        return sessions
+
+    def stats(self) -> dict:
+        with self.lock:
+            acquired = self.created + self.reused
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "dropped": self.dropped,
+                "reuse_rate": round(self.reused / acquired * 100, 1) if acquired else 0,
+                "idle": len(self.idle),
+            }
+
+
+def get_pool_size() -> int:
+    try:
+        return max(0, int(os.getenv("PARSER_SESSION_POOL", DEFAULT_POOL_SIZE)))
+    except ValueError:
+        return DEFAULT_POOL_SIZE
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_session_pool() -> SessionPool:
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = SessionPool(get_pool_size(), close=lambda session: session.close())
+        return _pool
@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import json
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SNAPSHOT_VERSION = 1
+COORD_SCALE = 10 ** 6
+TEXT_COLUMNS = ("name", "phone", "address")
+
+
+def encode_columns(pharmacies: list) -> dict:
+    # Column per field instead of a dict per record. City and district are
+    # indexes into string tables; coordinates are integers in microdegrees.
+    cities = {}
+    districts = {}
+    columns = {
+        "v": SNAPSHOT_VERSION,
+        "scale": COORD_SCALE,
+        "cities": [],
+        "districts": [],
+        "city": [],
+        "district": [],
+        **{column: [] for column in TEXT_COLUMNS},
+        "lat": [],
+        "long": [],
+    }
+
+    for record in pharmacies:
+        columns["city"].append(cities.setdefault(record["city"], len(cities)))
+        columns["district"].append(districts.setdefault(record["district"], len(districts)))
+        for column in TEXT_COLUMNS:
+            columns[column].append(record[column])
+        for column in ("lat", "long"):
+            value = record.get(column)
+            columns[column].append(None if value is None else round(float(value) * COORD_SCALE))
+
+    columns["cities"] = list(cities)
+    columns["districts"] = list(districts)
+    return columns
+
+
+def decode_columns(columns: dict) -> list:
+    if columns.get("v") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {columns.get('v')}")
+
+    scale = columns["scale"]
+    cities = columns["cities"]
+    districts = columns["districts"]
+    return [
+        {
+            "city": cities[city],
+            "district": districts[district],
+            "name": name,
+            "phone": phone,
+            "address": address,
+            "lat": None if lat is None else lat / scale,
+            "long": None if lon is None else lon / scale,
+        }
+        for city, district, name, phone, address, lat, lon in zip(
+            columns["city"],
+            columns["district"],
+            columns["name"],
+            columns["phone"],
+            columns["address"],
+            columns["lat"],
+            columns["long"],
+        )
+    ]
+
+
+def compressors() -> dict:
+    available = {"gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        available["br"] = lambda data: brotli.compress(data, quality=11)
+    if zstandard is not None:
+        available["zstd"] = zstandard.ZstdCompressor(level=19).compress
+    return available
+
+
+def decompress(data: bytes, encoding: str = None) -> bytes:
+    if not encoding or encoding == "identity":
+        return data
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br" and brotli is not None:
+        return brotli.decompress(data)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported snapshot encoding: {encoding}")
+
+
+def get_encodings():
+    # SNAPSHOT_ENCODINGS=gzip,br,zstd turns snapshots on; unset means off.
+    # Encodings whose module is not installed are skipped.
+    requested = os.getenv("SNAPSHOT_ENCODINGS", "").strip()
+    if not requested:
+        return None
+    available = compressors()
+    return [encoding for encoding in (part.strip() for part in requested.split(",")) if encoding in available]
+
+
+def build_snapshot(pharmacies: list, encodings=None) -> dict:
+    # The version is derived from the content, so identical days always get
+    # the same version and consumers can use it as an ETag.
+    raw = json.dumps(encode_columns(pharmacies), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()
+    available = compressors()
+    encodings = encodings or []
+
+    return {
+        "version": digest[:16],
+        "sha256": digest,
+        "count": len(pharmacies),
+        "payloads": {
+            "identity": raw,
+            **{encoding: available[encoding](raw) for encoding in encodings if encoding in available},
+        },
+    }
+
+
+def decode_snapshot(data: bytes, encoding: str = None) -> list:
+    return decode_columns(json.loads(decompress(data, encoding)))
@@ -0,0 +1,888 @@
+import base64
+import json
+import math
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+from archive import archive_day
+from city_mapping import by_population, get_city_name
+from changes import change_entry, content_hash
+from coord_cache import get_cache
+from dotenv import load_dotenv
+from geo_index import DEFAULT_NEAREST, build_index, distance_km, nearest
+from snapshot import build_snapshot, decode_snapshot, get_encodings
+from upstash_redis import Redis
+from validate import describe, update_cache, validate_day
+
+load_dotenv()
+
+DATA_TTL = 604800
+ALL_PLAKA_CODES = [str(plaka_kodu) for plaka_kodu in range(1, 82)]
+BACKENDS = ("redis", "file", "sqlite")
+DEFAULT_FILE_ROOT = "data"
+DEFAULT_SQLITE_PATH = os.path.join("data", "pharmacies.sqlite3")
+KM_PER_DEGREE = 111.32
+
+STATUS_DONE = "done"
+STATUS_PARTIAL = "partial"
+STATUS_FAILED = "failed"
+# Scraped ahead of its date. The sweep for that date scrapes it again to
+# catch roster changes made since, which is cheap with cached coordinates.
+STATUS_EARLY = "early"
+# A city whose map pages still lack coordinates after this many complete
+# scrapes counts as done for the sweep; the missing pins are upstream's.
+MAX_PARTIAL_ATTEMPTS = 3
+
+
+def get_redis_client():
+    try:
+        return Redis(
+            url=os.getenv("UPSTASH_REDIS_REST_URL"),
+            token=os.getenv("UPSTASH_REDIS_REST_TOKEN"),
+        )
+    except Exception as e:
+        print(f"✗ Redis connection failed: {e}")
+        return None
+
+
+def cities_key(date_key: str) -> str:
+    return f"{date_key}:cities"
+
+
+def progress_key(date_key: str) -> str:
+    return f"{date_key}:progress"
+
+
+def index_key(date_key: str, name: str) -> str:
+    return f"{date_key}:{name}"
+
+
+def snapshot_key(date_key: str) -> str:
+    return f"{date_key}:snapshot"
+
+
+def hashes_key(date_key: str) -> str:
+    return f"{date_key}:hashes"
+
+
+def changes_key(date_key: str) -> str:
+    return f"{date_key}:changes"
+
+
+def version_key(date_key: str) -> str:
+    return f"{date_key}:version"
+
+
+def staging_key(key: str, stage: str) -> str:
+    return f"{key}:staging:{stage}"
+
+
+SNAPSHOT_FILES = {"identity": "snapshot.json", "gzip": "snapshot.json.gz", "br": "snapshot.json.br", "zstd": "snapshot.json.zst"}
+
+
+def snapshot_values(snapshot: dict) -> dict:
+    # The REST API only carries text, so compressed variants go in as base64
+    # fields of one hash alongside the version.
+    values = {"version": snapshot["version"], "sha256": snapshot["sha256"], "count": snapshot["count"]}
+    for encoding, payload in snapshot["payloads"].items():
+        values[encoding] = payload.decode("utf-8") if encoding == "identity" else base64.b64encode(payload).decode("ascii")
+    return values
+
+
+def to_records(plaka_kodu: str, pharmacies: list) -> list:
+    city_name = get_city_name(plaka_kodu).title()
+    return [pharmacy.as_record(city_name) for pharmacy in pharmacies]
+
+
+class RedisStorage:
+    name = "Redis"
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def write_city(self, date_key, plaka_kodu, records, digest, change):
+        # One hash field per plate code: a city write never touches (or
+        # re-uploads) the rest of the day. Data, hash and change log entry
+        # go out in the same request.
+        pipeline = self.redis_client.pipeline()
+        pipeline.hset(cities_key(date_key), plaka_kodu, json.dumps(records, ensure_ascii=False))
+        pipeline.hset(hashes_key(date_key), plaka_kodu, digest)
+        pipeline.rpush(changes_key(date_key), json.dumps(change, ensure_ascii=False))
+        for key in (cities_key(date_key), hashes_key(date_key), changes_key(date_key)):
+            pipeline.expire(key, DATA_TTL)
+        pipeline.exec()
+
+    def write_draft(self, date_key, plaka_kodu, records):
+        pipeline = self.redis_client.pipeline()
+        pipeline.hset(cities_key(date_key), plaka_kodu, json.dumps(records, ensure_ascii=False))
+        pipeline.expire(cities_key(date_key), DATA_TTL)
+        pipeline.exec()
+
+    def read_city(self, date_key, plaka_kodu):
+        pipeline = self.redis_client.pipeline()
+        pipeline.hget(hashes_key(date_key), plaka_kodu)
+        pipeline.hget(cities_key(date_key), plaka_kodu)
+        digest, records = pipeline.exec()
+        return digest, json.loads(records) if records else None
+
+    def read_hash(self, date_key, field):
+        return self.redis_client.hget(hashes_key(date_key), field)
+
+    def read_changes(self, date_key) -> list:
+        return [json.loads(entry) for entry in self.redis_client.lrange(changes_key(date_key), 0, -1) or []]
+
+    def read_cities(self, date_key) -> dict:
+        stored = self.redis_client.hgetall(cities_key(date_key)) or {}
+        return {plaka_kodu: json.loads(records) for plaka_kodu, records in stored.items()}
+
+    def stage_hash(self, key, values, stage) -> bool:
+        # One request per key keeps each upload well under the REST request
+        # size limit.
+        pipeline = self.redis_client.pipeline()
+        pipeline.delete(staging_key(key, stage))
+        if values:
+            pipeline.hset(staging_key(key, stage), values=values)
+            pipeline.expire(staging_key(key, stage), DATA_TTL)
+        pipeline.exec()
+        return bool(values)
+
+    def write_day(self, date_key, pharmacies, indexes, snapshot, pointer):
+        # Everything is staged under "<key>:staging:<version>:<nonce>" and
+        # swapped in by one MULTI together with the version pointer, so
+        # readers get either the previous day or the new one, never a mix.
+        # The nonce keeps publishers of the same date (workers, the CLI) from
+        # renaming each other's staged keys. The flat list under the plain
+        # date key is what the web /pharmacy route reads.
+        stage = f"{pointer['version']}:{uuid.uuid4().hex[:6]}"
+        self.redis_client.set(staging_key(date_key, stage), json.dumps(pharmacies, ensure_ascii=False), ex=DATA_TTL)
+        staged = [date_key]
+        cleared = []
+        for name, entries in indexes.items():
+            key = index_key(date_key, name)
+            values = {field: json.dumps(records, ensure_ascii=False) for field, records in entries.items()}
+            (staged if self.stage_hash(key, values, stage) else cleared).append(key)
+        if snapshot:
+            self.stage_hash(snapshot_key(date_key), snapshot_values(snapshot), stage)
+            staged.append(snapshot_key(date_key))
+        else:
+            cleared.append(snapshot_key(date_key))
+
+        transaction = self.redis_client.multi()
+        for key in staged:
+            transaction.rename(staging_key(key, stage), key)
+        for key in cleared:
+            transaction.delete(key)
+        transaction.set(version_key(date_key), json.dumps(pointer), ex=DATA_TTL)
+        transaction.exec()
+
+    def read_version(self, date_key):
+        pointer = self.redis_client.get(version_key(date_key))
+        return json.loads(pointer) if pointer else None
+
+    def write_progress(self, date_key, plaka_kodu, entry):
+        pipeline = self.redis_client.pipeline()
+        pipeline.hset(progress_key(date_key), plaka_kodu, json.dumps(entry))
+        pipeline.expire(progress_key(date_key), DATA_TTL)
+        pipeline.exec()
+
+    def read_progress(self, date_key) -> dict:
+        stored = self.redis_client.hgetall(progress_key(date_key)) or {}
+        return {plaka_kodu: json.loads(entry) for plaka_kodu, entry in stored.items()}
+
+    def read_index(self, date_key, name, fields) -> dict:
+        fields = list(fields)
+        stored = self.redis_client.hmget(index_key(date_key, name), *fields) if fields else []
+        return {field: json.loads(records) for field, records in zip(fields, stored or []) if records}
+
+    def read_snapshot(self, date_key, encoding):
+        version, payload = self.redis_client.hmget(snapshot_key(date_key), "version", encoding) or (None, None)
+        if payload is None:
+            return None, None
+        return version, payload.encode("utf-8") if encoding == "identity" else base64.b64decode(payload)
+
+
+class FileStorage:
+    # One JSON file per city and per progress entry, replaced atomically,
+    # so concurrent workers never rewrite each other's data.
+    name = "File"
+
+    def __init__(self, root=DEFAULT_FILE_ROOT):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def day_path(self, date_key, *parts):
+        return os.path.join(self.root, date_key.replace("/", "-"), *parts)
+
+    def write_json(self, path, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump(value, handle, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def write_bytes(self, path, payload):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as handle:
+            handle.write(payload)
+        os.replace(temp_path, path)
+
+    def read_dir(self, path) -> dict:
+        if not os.path.isdir(path):
+            return {}
+        stored = {}
+        for filename in os.listdir(path):
+            if filename.endswith(".json"):
+                with open(os.path.join(path, filename), encoding="utf-8") as handle:
+                    stored[filename[:-5]] = json.load(handle)
+        return stored
+
+    def read_json(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)
+
+    def write_city(self, date_key, plaka_kodu, records, digest, change):
+        self.write_json(self.day_path(date_key, "cities", f"{plaka_kodu}.json"), records)
+        self.write_json(self.day_path(date_key, "hashes", f"{plaka_kodu}.json"), digest)
+        # Single short appends, so concurrent writers do not interleave lines.
+        with open(self.day_path(date_key, "changes.jsonl"), "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(change, ensure_ascii=False) + "\n")
+
+    def write_draft(self, date_key, plaka_kodu, records):
+        self.write_json(self.day_path(date_key, "cities", f"{plaka_kodu}.json"), records)
+
+    def read_city(self, date_key, plaka_kodu):
+        return (
+            self.read_hash(date_key, plaka_kodu),
+            self.read_json(self.day_path(date_key, "cities", f"{plaka_kodu}.json")),
+        )
+
+    def read_hash(self, date_key, field):
+        return self.read_json(self.day_path(date_key, "hashes", f"{field}.json"))
+
+    def read_changes(self, date_key) -> list:
+        path = self.day_path(date_key, "changes.jsonl")
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding="utf-8") as handle:
+            return [json.loads(line) for line in handle if line.strip()]
+
+    def read_cities(self, date_key) -> dict:
+        return self.read_dir(self.day_path(date_key, "cities"))
+
+    def version_path(self, date_key, version, *parts):
+        return self.day_path(date_key, "published", version, *parts)
+
+    def current_path(self, date_key, *parts):
+        pointer = self.read_version(date_key)
+        return self.version_path(date_key, pointer["version"], *parts) if pointer else None
+
+    def write_day(self, date_key, pharmacies, indexes, snapshot, pointer):
+        # Double buffered: a version is written to its own directory and
+        # becomes current when version.json is replaced. The previous one is
+        # kept for readers that already resolved its path.
+        previous = self.read_version(date_key)
+        version = pointer["version"]
+        self.write_json(self.version_path(date_key, version, "pharmacies.json"), pharmacies)
+        for name, entries in indexes.items():
+            self.write_json(self.version_path(date_key, version, "index", f"{name.replace(':', '-')}.json"), entries)
+        if snapshot:
+            for encoding, payload in snapshot["payloads"].items():
+                self.write_bytes(self.version_path(date_key, version, SNAPSHOT_FILES[encoding]), payload)
+            self.write_json(
+                self.version_path(date_key, version, "snapshot.meta.json"),
+                {
+                    "version": snapshot["version"],
+                    "sha256": snapshot["sha256"],
+                    "count": snapshot["count"],
+                    "encodings": list(snapshot["payloads"]),
+                },
+            )
+        self.write_json(self.day_path(date_key, "version.json"), pointer)
+
+        keep = {version, previous["version"] if previous else None}
+        for entry in os.scandir(self.day_path(date_key, "published")):
+            if entry.name not in keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        self.prune()
+
+    def read_version(self, date_key):
+        return self.read_json(self.day_path(date_key, "version.json"))
+
+    def write_progress(self, date_key, plaka_kodu, entry):
+        self.write_json(self.day_path(date_key, "progress", f"{plaka_kodu}.json"), entry)
+
+    def read_progress(self, date_key) -> dict:
+        return self.read_dir(self.day_path(date_key, "progress"))
+
+    def read_index(self, date_key, name, fields) -> dict:
+        path = self.current_path(date_key, "index", f"{name.replace(':', '-')}.json")
+        entries = self.read_json(path) if path else None
+        if not entries:
+            return {}
+        return {field: entries[field] for field in fields if field in entries}
+
+    def read_snapshot(self, date_key, encoding):
+        meta = self.current_path(date_key, "snapshot.meta.json")
+        if meta is None or encoding not in SNAPSHOT_FILES:
+            return None, None
+        path = os.path.join(os.path.dirname(meta), SNAPSHOT_FILES[encoding])
+        if not os.path.exists(meta) or not os.path.isfile(path):
+            return None, None
+        version = self.read_json(meta)["version"]
+        with open(path, "rb") as handle:
+            return version, handle.read()
+
+    def prune(self) -> int:
+        cutoff = time.time() - DATA_TTL
+        removed = 0
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+class SQLiteStorage:
+    name = "SQLite"
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pharmacies (
+                id INTEGER PRIMARY KEY,
+                date TEXT NOT NULL,
+                plaka INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                city TEXT NOT NULL,
+                district TEXT NOT NULL,
+                name TEXT NOT NULL,
+                phone TEXT NOT NULL,
+                address TEXT NOT NULL,
+                lat REAL,
+                long REAL,
+                saved_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pharmacies_city ON pharmacies (date, plaka, position);
+            CREATE INDEX IF NOT EXISTS idx_pharmacies_district ON pharmacies (date, city, district);
+            CREATE INDEX IF NOT EXISTS idx_pharmacies_saved_at ON pharmacies (saved_at);
+            CREATE VIRTUAL TABLE IF NOT EXISTS pharmacy_locations USING rtree (
+                id, min_lat, max_lat, min_long, max_long
+            );
+            CREATE TABLE IF NOT EXISTS progress (
+                date TEXT NOT NULL,
+                plaka INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                missing_coords INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (date, plaka)
+            );
+            CREATE TABLE IF NOT EXISTS days (
+                date TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                published_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS versions (
+                date TEXT PRIMARY KEY,
+                payload TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS hashes (
+                date TEXT NOT NULL,
+                field TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (date, field)
+            );
+            CREATE TABLE IF NOT EXISTS changes (
+                id INTEGER PRIMARY KEY,
+                date TEXT NOT NULL,
+                plaka INTEGER NOT NULL,
+                at INTEGER NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_changes_date ON changes (date, id);
+            CREATE TABLE IF NOT EXISTS snapshots (
+                date TEXT NOT NULL,
+                encoding TEXT NOT NULL,
+                version TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                PRIMARY KEY (date, encoding)
+            );
+            CREATE TABLE IF NOT EXISTS day_index (
+                date TEXT NOT NULL,
+                name TEXT NOT NULL,
+                field TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (date, name, field)
+            );
+            """
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(progress)")}
+        if "attempts" not in columns:
+            self.conn.execute("ALTER TABLE progress ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self.conn.commit()
+
+    def delete_rows(self, where, params):
+        ids = f"SELECT id FROM pharmacies WHERE {where}"
+        self.conn.execute(f"DELETE FROM pharmacy_locations WHERE id IN ({ids})", params)
+        self.conn.execute(f"DELETE FROM pharmacies WHERE {where}", params)
+
+    def write_city(self, date_key, plaka_kodu, records, digest, change):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO hashes (date, field, hash) VALUES (?, ?, ?)", (date_key, plaka_kodu, digest)
+            )
+            self.conn.execute(
+                "INSERT INTO changes (date, plaka, at, payload) VALUES (?, ?, ?, ?)",
+                (date_key, int(plaka_kodu), change["at"], json.dumps(change, ensure_ascii=False)),
+            )
+            self.write_rows(date_key, plaka_kodu, records)
+
+    def write_draft(self, date_key, plaka_kodu, records):
+        with self.lock, self.conn:
+            self.write_rows(date_key, plaka_kodu, records)
+
+    def write_rows(self, date_key, plaka_kodu, records):
+        now = time.time()
+        self.delete_rows("date = ? AND plaka = ?", (date_key, int(plaka_kodu)))
+        for position, record in enumerate(records):
+            row_id = self.conn.execute(
+                """
+                INSERT INTO pharmacies
+                    (date, plaka, position, city, district, name, phone, address, lat, long, saved_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    date_key,
+                    int(plaka_kodu),
+                    position,
+                    record["city"],
+                    record["district"],
+                    record["name"],
+                    record["phone"],
+                    record["address"],
+                    record["lat"],
+                    record["long"],
+                    now,
+                ),
+            ).lastrowid
+            if record["lat"] is not None and record["long"] is not None:
+                self.conn.execute(
+                    "INSERT INTO pharmacy_locations VALUES (?, ?, ?, ?, ?)",
+                    (row_id, record["lat"], record["lat"], record["long"], record["long"]),
+                )
+
+    def read_city(self, date_key, plaka_kodu):
+        digest = self.read_hash(date_key, plaka_kodu)
+        with self.lock:
+            rows = self.conn.execute(
+                """
+                SELECT city, district, name, phone, address, lat, long
+                FROM pharmacies WHERE date = ? AND plaka = ? ORDER BY position
+                """,
+                (date_key, int(plaka_kodu)),
+            ).fetchall()
+        return digest, [row_to_record(fields) for fields in rows] if digest else None
+
+    def read_hash(self, date_key, field):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT hash FROM hashes WHERE date = ? AND field = ?", (date_key, field)
+            ).fetchone()
+        return row[0] if row else None
+
+    def read_changes(self, date_key) -> list:
+        with self.lock:
+            rows = self.conn.execute("SELECT payload FROM changes WHERE date = ? ORDER BY id", (date_key,)).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def read_cities(self, date_key) -> dict:
+        with self.lock:
+            rows = self.conn.execute(
+                """
+                SELECT plaka, city, district, name, phone, address, lat, long
+                FROM pharmacies WHERE date = ? ORDER BY plaka, position
+                """,
+                (date_key,),
+            ).fetchall()
+
+        stored = {}
+        for plaka, *fields in rows:
+            stored.setdefault(str(plaka), []).append(row_to_record(fields))
+        return stored
+
+    def write_day(self, date_key, pharmacies, indexes, snapshot, pointer):
+        # One transaction: readers see the previous version until it commits.
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO days (date, payload, published_at) VALUES (?, ?, ?)",
+                (date_key, json.dumps(pharmacies, ensure_ascii=False), time.time()),
+            )
+            self.conn.execute("DELETE FROM day_index WHERE date = ?", (date_key,))
+            self.conn.executemany(
+                "INSERT INTO day_index (date, name, field, payload) VALUES (?, ?, ?, ?)",
+                (
+                    (date_key, name, field, json.dumps(records, ensure_ascii=False))
+                    for name, entries in indexes.items()
+                    for field, records in entries.items()
+                ),
+            )
+            self.conn.execute("DELETE FROM snapshots WHERE date = ?", (date_key,))
+            if snapshot:
+                self.conn.executemany(
+                    "INSERT INTO snapshots (date, encoding, version, payload) VALUES (?, ?, ?, ?)",
+                    (
+                        (date_key, encoding, snapshot["version"], payload)
+                        for encoding, payload in snapshot["payloads"].items()
+                    ),
+                )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO versions (date, payload) VALUES (?, ?)", (date_key, json.dumps(pointer))
+            )
+        self.prune()
+
+    def read_version(self, date_key):
+        with self.lock:
+            row = self.conn.execute("SELECT payload FROM versions WHERE date = ?", (date_key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write_progress(self, date_key, plaka_kodu, entry):
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO progress (date, plaka, status, count, missing_coords, updated_at, attempts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    date_key,
+                    int(plaka_kodu),
+                    entry["status"],
+                    entry["count"],
+                    entry["missing_coords"],
+                    entry["updated_at"],
+                    entry["attempts"],
+                ),
+            )
+
+    def read_progress(self, date_key) -> dict:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT plaka, status, count, missing_coords, updated_at, attempts FROM progress WHERE date = ?",
+                (date_key,),
+            ).fetchall()
+        return {
+            str(plaka): {
+                "status": status,
+                "count": count,
+                "missing_coords": missing_coords,
+                "updated_at": updated_at,
+                "attempts": attempts,
+            }
+            for plaka, status, count, missing_coords, updated_at, attempts in rows
+        }
+
+    def read_index(self, date_key, name, fields) -> dict:
+        fields = list(fields)
+        if not fields:
+            return {}
+        with self.lock:
+            rows = self.conn.execute(
+                f"""
+                SELECT field, payload FROM day_index
+                WHERE date = ? AND name = ? AND field IN ({", ".join("?" * len(fields))})
+                """,
+                (date_key, name, *fields),
+            ).fetchall()
+        return {field: json.loads(payload) for field, payload in rows}
+
+    def read_snapshot(self, date_key, encoding):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT version, payload FROM snapshots WHERE date = ? AND encoding = ?", (date_key, encoding)
+            ).fetchone()
+        return (row[0], bytes(row[1])) if row else (None, None)
+
+    def nearby(self, date_key, lat: float, lon: float, radius_km: float = 5, limit: int = 10) -> list:
+        # The R*Tree narrows the search to a bounding box; exact distances
+        # are only computed for the handful of rows inside it.
+        lat_delta = radius_km / KM_PER_DEGREE
+        lon_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        with self.lock:
+            rows = self.conn.execute(
+                """
+                SELECT p.city, p.district, p.name, p.phone, p.address, p.lat, p.long
+                FROM pharmacy_locations l JOIN pharmacies p ON p.id = l.id
+                WHERE l.min_lat >= ? AND l.max_lat <= ? AND l.min_long >= ? AND l.max_long <= ?
+                    AND p.date = ?
+                """,
+                (lat - lat_delta, lat + lat_delta, lon - lon_delta, lon + lon_delta, date_key),
+            ).fetchall()
+
+        results = []
+        for fields in rows:
+            record = row_to_record(fields)
+            record["distance"] = round(distance_km(lat, lon, record["lat"], record["long"]), 3)
+            if record["distance"] <= radius_km:
+                results.append(record)
+        results.sort(key=lambda record: record["distance"])
+        return results[:limit]
+
+    def prune(self) -> int:
+        cutoff = time.time() - DATA_TTL
+        with self.lock, self.conn:
+            self.delete_rows("saved_at < ?", (cutoff,))
+            self.conn.execute("DELETE FROM progress WHERE updated_at < ?", (cutoff,))
+            for table in ("day_index", "snapshots", "versions", "hashes", "changes"):
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE date IN (SELECT date FROM days WHERE published_at < ?)", (cutoff,)
+                )
+            return self.conn.execute("DELETE FROM days WHERE published_at < ?", (cutoff,)).rowcount
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+def row_to_record(fields) -> dict:
+    city, district, name, phone, address, lat, lon = fields
+    return {
+        "city": city,
+        "district": district,
+        "name": name,
+        "phone": phone,
+        "address": address,
+        "lat": lat,
+        "long": lon,
+    }
+
+
+def get_storage(kind: str = None):
+    kind = (kind or os.getenv("STORAGE_BACKEND", "redis")).lower()
+    try:
+        if kind == "file":
+            return FileStorage(os.getenv("STORAGE_PATH") or DEFAULT_FILE_ROOT)
+        if kind == "sqlite":
+            return SQLiteStorage(os.getenv("STORAGE_PATH") or DEFAULT_SQLITE_PATH)
+    except Exception as e:
+        print(f"✗ {kind} storage unavailable: {e}")
+        return None
+
+    redis_client = get_redis_client()
+    return RedisStorage(redis_client) if redis_client else None
+
+
+@metrics.timed("storage_write")
+def save_city(storage, date_key, plaka_kodu, pharmacies):
+    # Writes only when the city's content hash moved from the stored one,
+    # along with a change log entry diffing it against the stored version.
+    # The comparison is always against storage: other workers and the CLI
+    # write the same keys.
+    try:
+        if not storage:
+            return False
+
+        records = to_records(plaka_kodu, pharmacies)
+        digest = content_hash(records)
+        previous_hash, previous = storage.read_city(date_key, plaka_kodu)
+        if previous_hash != digest:
+            # Without a hash the stored list is at most a draft, not a
+            # version to diff against.
+            change = change_entry(plaka_kodu, previous_hash, digest, previous if previous_hash else None, records)
+            storage.write_city(date_key, plaka_kodu, records, digest, change)
+            metrics.count_write("city", "written")
+        else:
+            metrics.count_write("city", "unchanged")
+        return True
+    except Exception as e:
+        print(f"✗ Storage save error: {e}")
+        return False
+
+
+@metrics.timed("storage_write")
+def save_draft(storage, date_key, plaka_kodu, pharmacies):
+    # Early list of a city that is still being scraped, for the website. It
+    # stores no hash and logs no change, and is skipped once the city has a
+    # final save, so a re-sweep never replaces stored coordinates with
+    # missing ones. save_city() replaces it. Returns whether it was written.
+    try:
+        if not storage:
+            return False
+
+        if storage.read_hash(date_key, plaka_kodu) is not None:
+            metrics.count_write("draft", "skipped")
+            return False
+        storage.write_draft(date_key, plaka_kodu, to_records(plaka_kodu, pharmacies))
+        metrics.count_write("draft", "written")
+        return True
+    except Exception as e:
+        print(f"✗ Storage save error: {e}")
+        return False
+
+
+def load_day(storage, date_key) -> list:
+    if not storage:
+        return []
+
+    stored = storage.read_cities(date_key)
+    pharmacies = []
+    for plaka_kodu in sorted(stored, key=int):
+        pharmacies.extend(stored[plaka_kodu])
+    return pharmacies
+
+
+@metrics.timed("storage_write")
+def publish_day(storage, date_key):
+    # Validates the flat day list, then assembles its tile and district
+    # indexes and the snapshot and publishes them together behind a new
+    # version pointer.
+    try:
+        if not storage:
+            return False
+
+        pharmacies = load_day(storage, date_key)
+        if not pharmacies:
+            return False
+
+        pharmacies, report, changed = validate_day(pharmacies)
+        update_cache(get_cache(), changed)
+        if report["repaired"] or report["flagged"]:
+            print(f"🧹 {date_key}: {describe(report)} ({report['seconds'] * 1000:.1f}ms)")
+        for plaka_kodu in report["misfiled"]:
+            print(f"⚠️ {date_key}: city {plaka_kodu} mostly lists points in another province")
+
+        archive_day(date_key, pharmacies)
+        version = content_hash(pharmacies)
+        # Days with failed or unscraped cities are still published, flagged
+        # incomplete so the API keeps them out of long-lived caches.
+        complete = not pending_cities(storage, date_key)
+        current = storage.read_version(date_key)
+        if current and current["version"] == version and current.get("complete") == complete:
+            metrics.count_write("day", "unchanged")
+            return True
+
+        encodings = get_encodings()
+        snapshot = build_snapshot(pharmacies, encodings) if encodings is not None else None
+        pointer = {
+            "version": version,
+            "count": len(pharmacies),
+            "published_at": int(time.time()),
+            "complete": complete,
+            "snapshot": snapshot["version"] if snapshot else None,
+        }
+        storage.write_day(date_key, pharmacies, build_index(pharmacies), snapshot, pointer)
+        metrics.count_write("day", "written")
+        return True
+    except Exception as e:
+        print(f"✗ Storage publish error: {e}")
+        return False
+
+
+@metrics.timed("storage_write")
+def record_progress(storage, date_key, plaka_kodu, status, count=0, missing_coords=0, final=False):
+    # Partial entries carry how many complete scrapes ended partial; early
+    # list publishes keep the count, the final save of a scrape adds one.
+    try:
+        if not storage:
+            return False
+
+        attempts = 0
+        if status == STATUS_PARTIAL:
+            previous = storage.read_progress(date_key).get(plaka_kodu, {})
+            attempts = previous.get("attempts", 0) + (1 if final else 0)
+
+        entry = {
+            "status": status,
+            "count": count,
+            "missing_coords": missing_coords,
+            "updated_at": int(time.time()),
+            "attempts": attempts,
+        }
+        storage.write_progress(date_key, plaka_kodu, entry)
+        return True
+    except Exception as e:
+        print(f"✗ Storage progress error: {e}")
+        return False
+
+
+def load_progress(storage, date_key) -> dict:
+    try:
+        if not storage:
+            return {}
+        return storage.read_progress(date_key)
+    except Exception as e:
+        print(f"✗ Storage progress error: {e}")
+        return {}
+
+
+def load_changes(storage, date_key) -> list:
+    try:
+        if not storage:
+            return []
+        return storage.read_changes(date_key)
+    except Exception as e:
+        print(f"✗ Storage change log error: {e}")
+        return []
+
+
+def load_version(storage, date_key):
+    # The published version pointer: {"version", "count", "published_at",
+    # "complete", "snapshot"}, or None before the first publish of the date.
+    if not storage:
+        return None
+    return storage.read_version(date_key)
+
+
+def load_snapshot(storage, date_key, encoding="gzip"):
+    # Returns (version, pharmacies) from the compact snapshot, or (None, [])
+    # when none was published for the date.
+    if not storage:
+        return None, []
+    version, payload = storage.read_snapshot(date_key, encoding)
+    if payload is None:
+        return None, []
+    return version, decode_snapshot(payload, encoding)
+
+
+def nearest_pharmacies(storage, date_key, lat: float, lon: float, limit: int = DEFAULT_NEAREST) -> list:
+    if not storage:
+        return []
+    return nearest(
+        lambda name, fields: storage.read_index(date_key, name, fields),
+        lat,
+        lon,
+        limit,
+        read_all=lambda: load_day(storage, date_key),
+    )
+
+
+def is_settled(entry: dict) -> bool:
+    if entry.get("status") == STATUS_DONE:
+        return True
+    return entry.get("status") == STATUS_PARTIAL and entry.get("attempts", 0) >= MAX_PARTIAL_ATTEMPTS
+
+
+def pending_cities(storage, date_key, early=True) -> list:
+    # Failed and never scraped cities, plus partial ones with scrapes left,
+    # then the early ones still to be checked unless early is False.
+    progress = load_progress(storage, date_key)
+    pending = [plaka_kodu for plaka_kodu in ALL_PLAKA_CODES if not is_settled(progress.get(plaka_kodu, {}))]
+    ahead = [plaka_kodu for plaka_kodu in pending if progress.get(plaka_kodu, {}).get("status") == STATUS_EARLY]
+    rest = [plaka_kodu for plaka_kodu in pending if plaka_kodu not in ahead]
+    return by_population(rest) + (by_population(ahead) if early else [])
@@ -0,0 +1,255 @@
+import time
+
+import numpy as np
+
+import metrics
+from city_mapping import get_city_name
+from coord_cache import normalize_text
+from pharmacy import clean_phone_number
+
+# min_lat, max_lat, min_long, max_long
+TURKEY_BOUNDS = (35.8, 42.2, 25.6, 44.9)
+# Rough bounding box of each province by plate code; PROVINCE_MARGIN is
+# added on every side, so points near a border are never cleared.
+PROVINCE_BOUNDS = {
+    "1": (36.5, 38.5, 34.8, 36.4),
+    "2": (37.4, 38.3, 37.3, 39.3),
+    "3": (37.7, 39.3, 29.6, 31.6),
+    "4": (39.1, 40.1, 42.3, 44.4),
+    "5": (40.3, 41.1, 34.9, 36.4),
+    "6": (38.7, 40.7, 31.1, 33.9),
+    "7": (36.1, 37.6, 29.2, 32.6),
+    "8": (40.5, 41.6, 41.2, 42.6),
+    "9": (37.2, 38.2, 27.0, 28.9),
+    "10": (39.0, 40.6, 26.6, 28.9),
+    "11": (39.7, 40.5, 29.6, 30.6),
+    "12": (38.5, 39.5, 40.0, 41.5),
+    "13": (38.0, 39.0, 41.4, 43.0),
+    "14": (40.1, 41.1, 30.5, 32.6),
+    "15": (36.9, 38.0, 29.3, 30.8),
+    "16": (39.5, 40.7, 28.1, 30.0),
+    "17": (39.4, 40.8, 25.6, 27.6),
+    "18": (40.1, 41.1, 32.5, 34.3),
+    "19": (39.9, 41.3, 33.9, 35.6),
+    "20": (36.9, 38.5, 28.5, 30.0),
+    "21": (37.5, 38.8, 39.4, 41.3),
+    "22": (40.5, 42.1, 25.9, 27.1),
+    "23": (38.2, 39.2, 38.3, 40.4),
+    "24": (39.1, 40.1, 38.2, 40.5),
+    "25": (39.1, 41.0, 40.4, 42.6),
+    "26": (39.0, 40.2, 29.9, 32.1),
+    "27": (36.7, 37.6, 36.4, 38.1),
+    "28": (40.0, 41.2, 37.9, 39.2),
+    "29": (39.8, 40.8, 38.7, 40.0),
+    "30": (36.9, 37.9, 43.0, 44.85),
+    "31": (35.8, 37.1, 35.7, 36.7),
+    "32": (37.3, 38.5, 30.0, 31.6),
+    "33": (36.0, 37.5, 32.5, 35.2),
+    "34": (40.8, 41.6, 27.9, 30.0),
+    "35": (37.8, 39.4, 26.2, 28.5),
+    "36": (39.9, 41.0, 42.3, 43.8),
+    "37": (40.8, 42.1, 32.5, 34.8),
+    "38": (37.7, 39.3, 34.8, 36.9),
+    "39": (41.2, 42.1, 26.9, 28.1),
+    "40": (38.8, 39.8, 33.4, 34.9),
+    "41": (40.5, 41.2, 29.3, 30.4),
+    "42": (36.7, 39.3, 31.2, 34.5),
+    "43": (38.7, 39.9, 28.7, 30.5),
+    "44": (37.9, 39.3, 37.3, 39.2),
+    "45": (38.1, 39.4, 27.1, 29.1),
+    "46": (37.2, 38.6, 36.2, 37.7),
+    "47": (36.9, 37.7, 40.1, 42.0),
+    "48": (36.3, 37.6, 27.2, 29.6),
+    "49": (38.5, 39.4, 41.0, 42.8),
+    "50": (38.2, 39.3, 34.1, 35.1),
+    "51": (37.2, 38.4, 33.9, 35.3),
+    "52": (40.3, 41.2, 36.8, 38.2),
+    "53": (40.6, 41.4, 40.1, 41.5),
+    "54": (40.3, 41.2, 29.9, 30.9),
+    "55": (40.7, 41.8, 34.9, 37.2),
+    "56": (37.5, 38.4, 41.3, 42.9),
+    "57": (41.2, 42.15, 34.1, 35.5),
+    "58": (38.6, 40.4, 35.8, 38.8),
+    "59": (40.5, 41.6, 26.6, 28.2),
+    "60": (39.9, 40.9, 35.5, 37.7),
+    "61": (40.4, 41.2, 38.9, 40.5),
+    "62": (38.7, 39.6, 38.6, 40.1),
+    "63": (36.6, 37.9, 37.7, 40.3),
+    "64": (38.2, 39.1, 28.7, 29.9),
+    "65": (37.8, 39.4, 42.6, 44.6),
+    "66": (38.8, 40.3, 34.0, 36.3),
+    "67": (40.9, 41.6, 31.2, 32.4),
+    "68": (37.9, 39.1, 33.0, 34.6),
+    "69": (39.9, 40.6, 39.6, 40.8),
+    "70": (36.4, 37.8, 32.4, 34.2),
+    "71": (39.2, 40.3, 33.2, 34.3),
+    "72": (37.5, 38.5, 40.8, 41.9),
+    "73": (37.1, 37.8, 41.3, 43.5),
+    "74": (41.3, 41.9, 32.0, 32.9),
+    "75": (40.7, 41.6, 42.3, 43.5),
+    "76": (39.6, 40.2, 43.2, 44.85),
+    "77": (40.4, 40.8, 28.7, 29.6),
+    "78": (40.8, 41.6, 32.1, 33.2),
+    "79": (36.5, 37.0, 36.6, 37.5),
+    "80": (36.8, 37.5, 35.8, 36.7),
+    "81": (40.6, 41.2, 30.8, 31.8),
+}
+PROVINCE_MARGIN = 0.2
+# Records carry the city name as storage.to_records() writes it.
+PLATE_BY_CITY = {get_city_name(plaka_kodu).title(): plaka_kodu for plaka_kodu in PROVINCE_BOUNDS}
+# A city whose located pharmacies mostly fall outside its own province was
+# filed under the wrong plate code, provided it has at least this many.
+MIN_CITY_POINTS = 3
+
+
+def in_bounds(lat, lon, bounds=TURKEY_BOUNDS):
+    min_lat, max_lat, min_long, max_long = bounds
+    return (lat >= min_lat) & (lat <= max_lat) & (lon >= min_long) & (lon <= max_long)
+
+
+def province_boxes(plates) -> tuple:
+    # Per-record box columns; unknown cities get Turkey's.
+    boxes = np.array([PROVINCE_BOUNDS.get(plaka_kodu, TURKEY_BOUNDS) for plaka_kodu in plates], dtype=float)
+    boxes += (-PROVINCE_MARGIN, PROVINCE_MARGIN, -PROVINCE_MARGIN, PROVINCE_MARGIN)
+    return tuple(boxes.T)
+
+
+def misfiled_cities(cities, outside, located) -> np.ndarray:
+    # True for every record of a city whose located pharmacies are mostly
+    # outside its province.
+    misfiled = np.zeros(len(cities), dtype=bool)
+    for city in np.unique(cities[located]):
+        members = cities == city
+        count = (members & located).sum()
+        if count >= MIN_CITY_POINTS and (members & outside).sum() * 2 > count:
+            misfiled |= members
+    return misfiled
+
+
+def duplicate_mask(keys, preferred=None) -> np.ndarray:
+    # True for every row but one per key: the first preferred row if the key
+    # has one, else the first row.
+    order = np.arange(len(keys))
+    if preferred is not None:
+        order = np.lexsort((order, ~preferred))
+    _, first = np.unique(keys[order], return_index=True)
+    duplicate = np.ones(len(keys), dtype=bool)
+    duplicate[order[first]] = False
+    return duplicate
+
+
+def shared_phones(cities, phones) -> np.ndarray:
+    # True where the same phone number is listed under more than one city.
+    known = phones != ""
+    if not known.any():
+        return known
+    pairs = np.unique(np.stack([phones[known], cities[known]], axis=1), axis=0)
+    numbers, counts = np.unique(pairs[:, 0], return_counts=True)
+    return np.isin(phones, numbers[counts > 1]) & known
+
+
+def validate_day(pharmacies: list):
+    # Checks a whole day's records at once against their plate code's
+    # province and repairs what it can in place: swapped coordinates are
+    # swapped back, coordinates outside the province are cleared, the same
+    # pharmacy listed twice is kept once and phones are normalized. Cities
+    # whose list seems to belong to another province are flagged. Returns the kept
+    # records, a report, and the records whose cached coordinates should
+    # change.
+    started = time.perf_counter()
+    report = {"checked": len(pharmacies), "repaired": {}, "flagged": {}, "dropped": 0, "misfiled": []}
+    if not pharmacies:
+        return pharmacies, report, []
+
+    cities = np.array([p["city"] for p in pharmacies])
+    names = [normalize_text(p["name"]) for p in pharmacies]
+    phones = np.array([clean_phone_number(p["phone"]) or "" for p in pharmacies])
+    lat = np.array([p["lat"] for p in pharmacies], dtype=float)
+    lon = np.array([p["long"] for p in pharmacies], dtype=float)
+    plates = np.array([PLATE_BY_CITY.get(city, "") for city in cities])
+    boxes = province_boxes(plates)
+
+    # has_coordinates() treats 0 as missing, so normalize it to missing here.
+    missing = np.isnan(lat) | np.isnan(lon) | (lat == 0) | (lon == 0)
+    located = ~missing
+    swapped = located & ~in_bounds(lat, lon, boxes) & in_bounds(lon, lat, boxes)
+    lat[swapped], lon[swapped] = lon[swapped], lat[swapped]
+    inside = located & in_bounds(lat, lon, boxes)
+
+    # A misfiled list keeps its records, only its coordinates are cleared
+    # like any other point outside the province.
+    misfiled = misfiled_cities(cities, located & ~inside, located)
+    outside = located & ~inside
+    outside_turkey = outside & ~in_bounds(lat, lon)
+
+    same_city = duplicate_mask(
+        np.array([f"{p['city']}|{normalize_text(p['district'])}|{name}" for p, name in zip(pharmacies, names)])
+    )
+    # The same pharmacy under two plate codes: name and phone match. The
+    # copy inside its own province wins.
+    same_pharmacy = duplicate_mask(
+        np.array([f"{name}|{phone}" if phone else str(index) for index, (name, phone) in enumerate(zip(names, phones))]),
+        preferred=inside & ~same_city,
+    )
+    dropped = same_city | same_pharmacy
+
+    renormalized = phones != np.array([p["phone"] or "" for p in pharmacies])
+    bad_phone = ~((np.char.str_len(phones) == 11) & np.char.startswith(phones, "0")) & ~dropped
+    shared = shared_phones(cities[~dropped], phones[~dropped])
+
+    for name, mask in (
+        ("swapped", swapped & ~dropped),
+        ("outside_turkey", outside_turkey & ~dropped),
+        ("outside_province", outside & ~outside_turkey & ~dropped),
+        ("duplicate", dropped),
+        ("phone", renormalized & ~dropped),
+    ):
+        if mask.any():
+            report["repaired"][name] = int(mask.sum())
+    for name, mask in (
+        ("missing_coords", missing & ~dropped),
+        ("bad_phone", bad_phone),
+        ("shared_phone", shared),
+        ("misfiled", misfiled & ~dropped),
+    ):
+        if mask.any():
+            report["flagged"][name] = int(mask.sum())
+
+    changed = []
+    for index in np.flatnonzero((swapped | outside | missing | renormalized) & ~dropped):
+        record = pharmacies[index]
+        if swapped[index]:
+            record["lat"], record["long"] = float(lat[index]), float(lon[index])
+        elif outside[index] or missing[index]:
+            record["lat"] = record["long"] = None
+        if swapped[index] or outside[index]:
+            changed.append(record)
+        if renormalized[index]:
+            record["phone"] = str(phones[index])
+
+    kept = [pharmacies[index] for index in np.flatnonzero(~dropped)]
+    report["dropped"] = int(dropped.sum())
+    report["misfiled"] = sorted(set(plates[misfiled].tolist()) - {""}, key=int)
+    report["seconds"] = round(time.perf_counter() - started, 4)
+
+    for bucket in ("repaired", "flagged"):
+        for check, count in report[bucket].items():
+            metrics.count_validation(check, bucket, count)
+    return kept, report, changed
+
+
+def update_cache(cache, records: list) -> None:
+    # Swapped coordinates go back to the cache corrected; cleared ones are
+    # dropped so the next sweep looks them up again instead of reusing them.
+    if cache is None:
+        return
+    for record in records:
+        if record["lat"] is None:
+            cache.discard(record["name"], record["district"], record["address"])
+        else:
+            cache.set(record["name"], record["district"], record["address"], record["lat"], record["long"])
+
+
+def describe(report: dict) -> str:
+    issues = {**report["repaired"], **report["flagged"]}
+    return ", ".join(f"{count} {check.replace('_', ' ')}" for check, count in issues.items())
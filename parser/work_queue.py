@@ -0,0 +1,226 @@
+import fcntl
+import json
+import os
+import socket
+import time
+import uuid
+
+DEFAULT_LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+DEFAULT_FILE_PATH = os.path.join("cache", "work_queue.json")
+KEY_PREFIX = "queue"
+
+
+def job_id(date_key: str, plaka_kodu: str) -> str:
+    return f"{date_key}|{plaka_kodu}"
+
+
+def parse_job(job: str):
+    date_key, _, plaka_kodu = job.partition("|")
+    return date_key, plaka_kodu
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+# KEYS: pending list, lease zset, owner hash, job set, remaining hash, attempts hash
+ENQUEUE_SCRIPT = """
+local added = 0
+for i = 2, #ARGV do
+    if redis.call("SADD", KEYS[4], ARGV[i]) == 1 then
+        redis.call("LPUSH", KEYS[1], ARGV[i])
+        redis.call("HINCRBY", KEYS[5], ARGV[1], 1)
+        added = added + 1
+    end
+end
+return added
+"""
+
+LEASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local expired = redis.call("ZRANGEBYSCORE", KEYS[2], "-inf", now)
+for _, job in ipairs(expired) do
+    redis.call("ZREM", KEYS[2], job)
+    redis.call("HDEL", KEYS[3], job)
+    redis.call("RPUSH", KEYS[1], job)
+end
+local job = redis.call("RPOP", KEYS[1])
+if not job then
+    return false
+end
+redis.call("ZADD", KEYS[2], now + tonumber(ARGV[3]), job)
+redis.call("HSET", KEYS[3], job, ARGV[2])
+redis.call("HINCRBY", KEYS[6], job, 1)
+return job
+"""
+
+HEARTBEAT_SCRIPT = """
+if redis.call("HGET", KEYS[3], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call("ZADD", KEYS[2], tonumber(ARGV[3]) + tonumber(ARGV[4]), ARGV[1])
+return 1
+"""
+
+FINISH_SCRIPT = """
+if redis.call("HGET", KEYS[3], ARGV[1]) ~= ARGV[2] then
+    return -1
+end
+redis.call("ZREM", KEYS[2], ARGV[1])
+redis.call("HDEL", KEYS[3], ARGV[1])
+if ARGV[4] == "retry" and tonumber(redis.call("HGET", KEYS[6], ARGV[1]) or "0") < tonumber(ARGV[5]) then
+    redis.call("LPUSH", KEYS[1], ARGV[1])
+    return tonumber(redis.call("HGET", KEYS[5], ARGV[3]) or "0")
+end
+redis.call("SREM", KEYS[4], ARGV[1])
+redis.call("HDEL", KEYS[6], ARGV[1])
+return redis.call("HINCRBY", KEYS[5], ARGV[3], -1)
+"""
+
+
+class RedisWorkQueue:
+    # Every state change is a single Lua script, so any number of workers
+    # on any number of hosts can share the queue safely.
+    def __init__(self, redis_client, prefix=KEY_PREFIX, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.redis_client = redis_client
+        self.lease_seconds = lease_seconds
+        self.keys = [
+            f"{prefix}:pending",
+            f"{prefix}:leases",
+            f"{prefix}:owners",
+            f"{prefix}:jobs",
+            f"{prefix}:remaining",
+            f"{prefix}:attempts",
+        ]
+
+    def enqueue(self, date_key: str, plaka_codes) -> int:
+        jobs = [job_id(date_key, plaka_kodu) for plaka_kodu in plaka_codes]
+        if not jobs:
+            return 0
+        return int(self.redis_client.eval(ENQUEUE_SCRIPT, keys=self.keys, args=[date_key, *jobs]) or 0)
+
+    def lease(self, worker_id: str):
+        job = self.redis_client.eval(
+            LEASE_SCRIPT, keys=self.keys, args=[str(time.time()), worker_id, str(self.lease_seconds)]
+        )
+        return job or None
+
+    def heartbeat(self, job: str, worker_id: str) -> bool:
+        renewed = self.redis_client.eval(
+            HEARTBEAT_SCRIPT, keys=self.keys, args=[job, worker_id, str(time.time()), str(self.lease_seconds)]
+        )
+        return int(renewed or 0) == 1
+
+    def finish(self, job: str, worker_id: str, retry: bool = False) -> int:
+        date_key, _ = parse_job(job)
+        remaining = self.redis_client.eval(
+            FINISH_SCRIPT,
+            keys=self.keys,
+            args=[job, worker_id, date_key, "retry" if retry else "done", str(MAX_ATTEMPTS)],
+        )
+        return int(remaining if remaining is not None else -1)
+
+    def remaining(self, date_key: str) -> int:
+        return int(self.redis_client.hget(self.keys[4], date_key) or 0)
+
+
+class FileWorkQueue:
+    # Same semantics as RedisWorkQueue on top of a JSON file guarded by an
+    # flock, for local runs and tests with several processes on one host.
+    def __init__(self, path=DEFAULT_FILE_PATH, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def transaction(self, change):
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        state = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    state = {"pending": [], "leases": {}, "remaining": {}, "attempts": {}}
+
+                result = change(state)
+
+                temp_path = f"{self.path}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(temp_path, self.path)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def enqueue(self, date_key: str, plaka_codes) -> int:
+        def change(state):
+            known = set(state["pending"]) | set(state["leases"])
+            added = 0
+            for plaka_kodu in plaka_codes:
+                job = job_id(date_key, plaka_kodu)
+                if job not in known:
+                    state["pending"].append(job)
+                    state["remaining"][date_key] = state["remaining"].get(date_key, 0) + 1
+                    known.add(job)
+                    added += 1
+            return added
+
+        return self.transaction(change)
+
+    def lease(self, worker_id: str):
+        def change(state):
+            now = time.time()
+            for job, lease in list(state["leases"].items()):
+                if lease["expires"] <= now:
+                    del state["leases"][job]
+                    state["pending"].insert(0, job)
+            if not state["pending"]:
+                return None
+            job = state["pending"].pop(0)
+            state["leases"][job] = {"worker": worker_id, "expires": now + self.lease_seconds}
+            state["attempts"][job] = state["attempts"].get(job, 0) + 1
+            return job
+
+        return self.transaction(change)
+
+    def heartbeat(self, job: str, worker_id: str) -> bool:
+        def change(state):
+            lease = state["leases"].get(job)
+            if not lease or lease["worker"] != worker_id:
+                return False
+            lease["expires"] = time.time() + self.lease_seconds
+            return True
+
+        return self.transaction(change)
+
+    def finish(self, job: str, worker_id: str, retry: bool = False) -> int:
+        date_key, _ = parse_job(job)
+
+        def change(state):
+            lease = state["leases"].get(job)
+            if not lease or lease["worker"] != worker_id:
+                return -1
+            del state["leases"][job]
+            if retry and state["attempts"].get(job, 0) < MAX_ATTEMPTS:
+                state["pending"].append(job)
+                return state["remaining"].get(date_key, 0)
+            state["attempts"].pop(job, None)
+            state["remaining"][date_key] = state["remaining"].get(date_key, 0) - 1
+            return state["remaining"][date_key]
+
+        return self.transaction(change)
+
+    def remaining(self, date_key: str) -> int:
+        return self.transaction(lambda state: state["remaining"].get(date_key, 0))
+
+
+def get_work_queue(kind: str = None, redis_client=None):
+    kind = (kind or os.getenv("WORK_QUEUE", "redis")).lower()
+    if kind == "file":
+        return FileWorkQueue(os.getenv("WORK_QUEUE_PATH", DEFAULT_FILE_PATH))
+    if redis_client is None:
+        return None
+    return RedisWorkQueue(redis_client)
@@ -1,5 +1,11 @@
 import { Hono } from 'hono';
 import { Redis } from '@upstash/redis';
+import {
+    TILE_PRECISIONS,
+    coveredRadiusKm,
+    distanceKm,
+    neighborhood,
+} from './geo';
 import { createResponse } from './utils';
 
 export const generalRoutes = new Hono();
@@ -14,15 +20,64 @@ interface PharmacyData {
     long: number;
 }
 
+interface RankedPharmacy extends PharmacyData {
+    distance: number;
+}
+
+// Written by the parser's publish_day() in the same transaction as the day
+// list it describes.
+interface DayVersion {
+    version: string;
+    count: number;
+    published_at: number;
+    // False while some cities are failed or not scraped yet.
+    complete?: boolean;
+    snapshot: string | null;
+}
+
+const DEFAULT_NEAREST = 10;
+const MAX_NEAREST = 50;
+
 const redis = new Redis({
     url: process.env.UPSTASH_REDIS_REST_URL || '',
     token: process.env.UPSTASH_REDIS_REST_TOKEN || '',
 });
 
-generalRoutes.get('/pharmacy', async () => {
+const PUBLISHED_CACHE_CONTROL =
+    'public, s-maxage=3600, stale-while-revalidate=3600';
+// An incomplete day is republished as the missing cities come in, so the
+// CDN may only hold it briefly.
+const INCOMPLETE_CACHE_CONTROL =
+    'public, s-maxage=60, stale-while-revalidate=30';
+
+generalRoutes.get('/pharmacy', async (c) => {
     try {
         const dateKey = getCurrentActiveDate();
+        const ifNoneMatch = c.req.header('If-None-Match');
 
+        // Conditional requests only cost the small version key when the
+        // published day has not changed.
+        if (ifNoneMatch) {
+            const current = await redis.get<DayVersion>(versionKey(dateKey));
+            if (current && ifNoneMatch === etag(current.version)) {
+                return notModified(current);
+            }
+        }
+
+        // The list and its pointer are read in one command, so the ETag
+        // always describes the body it is sent with.
+        const [published, current] = await redis.mget<
+            [PharmacyData[] | null, DayVersion | null]
+        >(dateKey, versionKey(dateKey));
+
+        if (published && current) {
+            const response = createResponse(true, published);
+            response.headers.set('ETag', etag(current.version));
+            response.headers.set('Cache-Control', cacheControl(current));
+            return response;
+        }
+
+        // Not published yet: the cities stored so far, never cached.
         const pharmacyData = await getPharmacyData(dateKey);
 
         if (!pharmacyData) {
@@ -33,23 +88,127 @@ generalRoutes.get('/pharmacy', async () => {
         }
 
         const response = createResponse(true, pharmacyData);
+        response.headers.set('Cache-Control', 'no-store');
 
+        return response;
+    } catch (error) {
+        console.error('Pharmacy API error:', error);
+        return createResponse(
+            false,
+            'Internal server error',
+            'Failed to fetch pharmacy data'
+        );
+    }
+});
+
+generalRoutes.get('/pharmacy/version', async () => {
+    try {
+        const dateKey = getCurrentActiveDate();
+        const current = await redis.get<DayVersion>(versionKey(dateKey));
+
+        if (!current) {
+            return createResponse(
+                false,
+                `No published pharmacy data for ${dateKey}`
+            );
+        }
+
+        const response = createResponse(true, { date: dateKey, ...current });
         response.headers.set(
             'Cache-Control',
-            'public, s-maxage=3600, stale-while-revalidate=3600'
+            'public, s-maxage=60, stale-while-revalidate=60'
         );
 
         return response;
     } catch (error) {
-        console.error('Pharmacy API error:', error);
+        console.error('Pharmacy version API error:', error);
         return createResponse(
             false,
             'Internal server error',
-            'Failed to fetch pharmacy data'
+            'Failed to fetch pharmacy data version'
+        );
+    }
+});
+
+generalRoutes.get('/pharmacy/nearby', async (c) => {
+    const lat = Number(c.req.query('lat'));
+    const long = Number(c.req.query('long'));
+    const limit = Math.min(
+        Math.max(Number(c.req.query('limit')) || DEFAULT_NEAREST, 1),
+        MAX_NEAREST
+    );
+
+    if (
+        !c.req.query('lat') ||
+        !c.req.query('long') ||
+        !Number.isFinite(lat) ||
+        !Number.isFinite(long)
+    ) {
+        return createResponse(
+            false,
+            'Invalid coordinates',
+            'lat and long query parameters are required'
+        );
+    }
+
+    try {
+        const dateKey = getCurrentActiveDate();
+        const pharmacies = await getNearestPharmacies(
+            dateKey,
+            lat,
+            long,
+            limit
+        );
+
+        if (!pharmacies) {
+            return createResponse(
+                false,
+                `No pharmacy data found for ${dateKey}`
+            );
+        }
+
+        const response = createResponse(true, pharmacies);
+
+        response.headers.set(
+            'Cache-Control',
+            'public, s-maxage=600, stale-while-revalidate=600'
+        );
+
+        return response;
+    } catch (error) {
+        console.error('Nearby pharmacy API error:', error);
+        return createResponse(
+            false,
+            'Internal server error',
+            'Failed to fetch nearby pharmacies'
         );
     }
 });
 
+function versionKey(dateKey: string): string {
+    return `${dateKey}:version`;
+}
+
+function etag(version: string): string {
+    return `"${version}"`;
+}
+
+function cacheControl(current: DayVersion): string {
+    return current.complete
+        ? PUBLISHED_CACHE_CONTROL
+        : INCOMPLETE_CACHE_CONTROL;
+}
+
+function notModified(current: DayVersion): Response {
+    return new Response(null, {
+        status: 304,
+        headers: {
+            ETag: etag(current.version),
+            'Cache-Control': cacheControl(current),
+        },
+    });
+}
+
 function getCurrentActiveDate(): string {
     const now = new Date();
 
@@ -90,9 +249,82 @@ async function getPharmacyData(
 
     try {
         const data = await redis.get<PharmacyData[]>(dateKey);
-        return data || null;
+        if (data) {
+            return data;
+        }
+
+        // The parser stores each city under its own hash field and only
+        // assembles the flat list once a sweep is done.
+        const cities = await redis.hgetall<Record<string, PharmacyData[]>>(
+            `${dateKey}:cities`
+        );
+        if (!cities) {
+            return null;
+        }
+
+        return Object.keys(cities)
+            .sort((a, b) => Number(a) - Number(b))
+            .flatMap((plateCode) => cities[plateCode]);
     } catch (error) {
         console.error('Redis error:', error);
         throw new Error('Failed to fetch data from Redis');
     }
 }
+
+function rankByDistance(
+    pharmacies: PharmacyData[],
+    lat: number,
+    long: number
+): RankedPharmacy[] {
+    return pharmacies
+        .filter((pharmacy) => pharmacy.lat != null && pharmacy.long != null)
+        .map((pharmacy) => ({
+            ...pharmacy,
+            distance:
+                Math.round(
+                    distanceKm(lat, long, pharmacy.lat, pharmacy.long) * 1000
+                ) / 1000,
+        }))
+        .sort((a, b) => a.distance - b.distance);
+}
+
+// Reads the tiles around the point from the index the parser publishes at
+// `${dateKey}:tiles:<precision>`, widening only when the closest `limit`
+// might lie outside them. The full day list is the last resort.
+async function getNearestPharmacies(
+    dateKey: string,
+    lat: number,
+    long: number,
+    limit: number
+): Promise<RankedPharmacy[] | null> {
+    try {
+        for (const precision of TILE_PRECISIONS) {
+            const tiles = await redis.hmget<Record<string, PharmacyData[]>>(
+                `${dateKey}:tiles:${precision}`,
+                ...neighborhood(lat, long, precision)
+            );
+            const ranked = rankByDistance(
+                Object.values(tiles ?? {}).flatMap((records) => records ?? []),
+                lat,
+                long
+            );
+
+            if (
+                ranked.length >= limit &&
+                ranked[limit - 1].distance <=
+                    coveredRadiusKm(lat, long, precision)
+            ) {
+                return ranked.slice(0, limit);
+            }
+        }
+    } catch (error) {
+        console.error('Redis tile index error:', error);
+    }
+
+    const pharmacyData = await getPharmacyData(dateKey);
+    if (!pharmacyData) {
+        return null;
+    }
+
+    return rankByDistance(pharmacyData, lat, long).slice(0, limit);
+}
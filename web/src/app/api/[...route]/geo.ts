@@ -0,0 +1,146 @@
+const GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz';
+const EARTH_RADIUS_KM = 6371;
+
+// Must match TILE_PRECISIONS in parser/geo_index.py: fine tiles first.
+export const TILE_PRECISIONS = [5, 4];
+
+interface Box {
+    minLat: number;
+    maxLat: number;
+    minLong: number;
+    maxLong: number;
+}
+
+export function encodeGeohash(
+    lat: number,
+    long: number,
+    precision: number
+): string {
+    const latRange = [-90, 90];
+    const longRange = [-180, 180];
+    let geohash = '';
+    let bits = 0;
+    let bitCount = 0;
+    let even = true;
+
+    while (geohash.length < precision) {
+        const value = even ? long : lat;
+        const range = even ? longRange : latRange;
+        const middle = (range[0] + range[1]) / 2;
+        bits <<= 1;
+        if (value >= middle) {
+            bits |= 1;
+            range[0] = middle;
+        } else {
+            range[1] = middle;
+        }
+        even = !even;
+        bitCount += 1;
+        if (bitCount === 5) {
+            geohash += GEOHASH_ALPHABET[bits];
+            bits = 0;
+            bitCount = 0;
+        }
+    }
+
+    return geohash;
+}
+
+function decodeBox(geohash: string): Box {
+    const latRange = [-90, 90];
+    const longRange = [-180, 180];
+    let even = true;
+
+    for (const char of geohash) {
+        const value = GEOHASH_ALPHABET.indexOf(char);
+        for (let shift = 4; shift >= 0; shift--) {
+            const range = even ? longRange : latRange;
+            const middle = (range[0] + range[1]) / 2;
+            if ((value >> shift) & 1) {
+                range[0] = middle;
+            } else {
+                range[1] = middle;
+            }
+            even = !even;
+        }
+    }
+
+    return {
+        minLat: latRange[0],
+        maxLat: latRange[1],
+        minLong: longRange[0],
+        maxLong: longRange[1],
+    };
+}
+
+export function neighborhood(
+    lat: number,
+    long: number,
+    precision: number
+): string[] {
+    const box = decodeBox(encodeGeohash(lat, long, precision));
+    const latStep = box.maxLat - box.minLat;
+    const longStep = box.maxLong - box.minLong;
+    const centerLat = (box.minLat + box.maxLat) / 2;
+    const centerLong = (box.minLong + box.maxLong) / 2;
+    const tiles: string[] = [];
+
+    for (const latOffset of [0, -1, 1]) {
+        for (const longOffset of [0, -1, 1]) {
+            const tile = encodeGeohash(
+                Math.max(-90, Math.min(90, centerLat + latOffset * latStep)),
+                ((centerLong + longOffset * longStep + 540) % 360) - 180,
+                precision
+            );
+            if (!tiles.includes(tile)) {
+                tiles.push(tile);
+            }
+        }
+    }
+
+    return tiles;
+}
+
+// Any pharmacy closer than this is guaranteed to sit in neighborhood().
+export function coveredRadiusKm(
+    lat: number,
+    long: number,
+    precision: number
+): number {
+    const box = decodeBox(encodeGeohash(lat, long, precision));
+    const latStep = box.maxLat - box.minLat;
+    const longStep = box.maxLong - box.minLong;
+    const latMargin = Math.min(
+        lat - (box.minLat - latStep),
+        box.maxLat + latStep - lat
+    );
+    const longMargin = Math.min(
+        long - (box.minLong - longStep),
+        box.maxLong + longStep - long
+    );
+    const kmPerDegree = (Math.PI * EARTH_RADIUS_KM) / 180;
+    const latitudeScale = Math.cos(
+        ((Math.abs(lat) + latStep) * Math.PI) / 180
+    );
+
+    return Math.min(
+        latMargin * kmPerDegree,
+        longMargin * kmPerDegree * latitudeScale
+    );
+}
+
+export function distanceKm(
+    lat1: number,
+    long1: number,
+    lat2: number,
+    long2: number
+): number {
+    const toRadians = (degrees: number) => (degrees * Math.PI) / 180;
+    const a =
+        Math.sin(toRadians(lat2 - lat1) / 2) ** 2 +
+        Math.cos(toRadians(lat1)) *
+            Math.cos(toRadians(lat2)) *
+            Math.sin(toRadians(long2 - long1) / 2) ** 2;
+
+    return 2 * EARTH_RADIUS_KM * Math.asin(Math.sqrt(a));
+}